@@ -33,25 +33,134 @@ Some usage examples:
 
       python backstore.py -d
 
+* Validate ``files.json``:
+  ::
+
+      python backstore.py --check
+
+* List the repository files missing from ``files.json``, or stubs to add them:
+  ::
+
+      python backstore.py --discover
+      python backstore.py --discover stubs
+
+* Link selected files installing their missing dependencies at once:
+  ::
+
+      python backstore.py -l --install
+
+* Link all files using eight parallel workers:
+  ::
+
+      python backstore.py -la --jobs 8
+
+* Compute the operations needed to link selected files and perform them
+  later:
+  ::
+
+      python backstore.py --plan > plan.ndjson
+      python backstore.py --apply plan.ndjson
+
+* Link selected files in every home directory listed in a file:
+  ::
+
+      python backstore.py -l --homes-file homes.txt
+
+* Restore the files replaced or deleted using ``--force``:
+  ::
+
+      python backstore.py --restore
+
+* Link selected files reporting where the time goes:
+  ::
+
+      python backstore.py -l --profile
+
+The module can also be imported to run the same operations from Python,
+streaming their results:
+::
+
+    import backstore
+
+    files = backstore.load_manifest([".config/nvim/**"])
+    for result in backstore.apply(backstore.plan(files), jobs=4):
+        print(result.file.relpath, result.outcome.value)
+
 """
-import argparse
 import contextlib
 import functools
-import json
+import marshal
 import os
-import subprocess
+import stat
 import sys
+import time
 
-from argparse import Namespace
+# ``argparse``, ``concurrent.futures``, ``hashlib`` and ``json`` are imported
+# where they are used, so simple invocations do not pay for them on startup.
+from collections import Counter, OrderedDict, deque
 from enum import Enum
 from pathlib import Path
-from typing import List, NamedTuple, Set
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+)
+
+__all__ = [
+    "Action",
+    "BackstoreError",
+    "FileResult",
+    "HomeFile",
+    "InstallMode",
+    "LinkState",
+    "Outcome",
+    "PlanAction",
+    "apply",
+    "load_manifest",
+    "load_plan",
+    "plan",
+]
+
+if TYPE_CHECKING:
+    from argparse import Namespace
+    from concurrent.futures import Future
 
 HOME_PATH: Path = Path.home()
 AUTOMATION_PATH: Path = Path(__file__).resolve().parent
 ALL_FILES_PATH: Path = (AUTOMATION_PATH / "files.json").resolve()
 SEL_FILES_PATH: Path = (AUTOMATION_PATH / "selected_files.txt").resolve()
 REPO_HOME_PATH: Path = (AUTOMATION_PATH.parent / "home").resolve()
+CACHE_PATH: Path = AUTOMATION_PATH / ".cache"
+USER_STATE_FILE_PATH: Path = AUTOMATION_PATH / ".backstore_state.json"
+STATE_FILE_PATH: Path = USER_STATE_FILE_PATH
+BACKUP_PATH: Path = AUTOMATION_PATH / ".backups"
+BUILD_PATH: Path = AUTOMATION_PATH / ".build"
+FICLONE: int = 0x40049409
+AUDIT_BATCH_SIZE: int = 64
+REPO_INDEX_MIN_FILES: int = 4096
+AUDIT_PRUNED_NAMES: Set[str] = {
+    ".cache",
+    ".cargo",
+    ".git",
+    ".hg",
+    ".npm",
+    ".rustup",
+    ".svn",
+    ".tox",
+    ".venv",
+    "Trash",
+    "__pycache__",
+    "node_modules",
+    "site-packages",
+}
 
 
 class colour(object):
@@ -76,24 +185,222 @@ class colour(object):
     reset = "\x1b(B\x1b[m"
 
 
+class Profiler(object):
+    """Wall time spent in each phase of a run and on each selected file.
+
+    While disabled, phases and timed functions run without being measured.
+
+    :ivar enabled: whether to measure the run or not.
+    :ivar slowest: number of slowest files reported.
+    :ivar phases: accumulated seconds of each phase, in order of appearance.
+    :ivar entries: accumulated seconds of each file relative path.
+
+    """
+
+    def __init__(self):
+        """Profiler constructor."""
+        self.enabled: bool = False
+        self.slowest: int = 10
+        self.phases: Dict[str, float] = {}
+        self.entries: Dict[str, float] = {}
+        self.__start_time: float = time.perf_counter()
+        self.__lock = None
+
+    def enable(self, slowest: int = 10) -> None:
+        """Start measuring the run.
+
+        :param slowest: number of slowest files reported.
+
+        """
+        import threading
+
+        self.enabled = True
+        self.slowest = slowest
+        self.__lock = threading.Lock()
+        self.__start_time = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Measure the wall time of the block as part of a phase.
+
+        :param name: phase name.
+
+        """
+        if not self.enabled:
+            yield
+            return
+
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start_time
+
+    def timed(self, function: Callable, key: Callable[..., str]) -> Callable:
+        """Wrap a per file function to measure each call.
+
+        :param function: function processing one file.
+        :param key: function obtaining the file relative path from the
+            arguments.
+        :returns: the wrapped function, or the same function while disabled.
+
+        """
+        if not self.enabled:
+            return function
+
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed_time = time.perf_counter() - start_time
+                entry = key(*args, **kwargs)
+                with self.__lock:
+                    self.entries[entry] = self.entries.get(entry, 0) + elapsed_time
+
+        return timed_function
+
+    def report(self, file: TextIO = sys.stderr) -> None:
+        """Print the phases and the slowest files.
+
+        :param file: stream to print the report to.
+
+        """
+        if not self.enabled:
+            return
+
+        lines = ["", "Profile:"]
+        lines.extend(f"  {name:<24} {seconds:>9.4f}s" for name, seconds in self.phases.items())
+        lines.append(f"  {'total':<24} {time.perf_counter() - self.__start_time:>9.4f}s")
+
+        if self.entries and self.slowest:
+            lines.extend(["", f"Slowest {min(self.slowest, len(self.entries))} files:"])
+            slowest_entries = sorted(self.entries.items(), key=lambda item: -item[1])
+            lines.extend(
+                f"  {seconds:>9.4f}s {entry}" for entry, seconds in slowest_entries[: self.slowest]
+            )
+
+        print("\n".join(lines), file=file, flush=True)
+
+
+profiler = Profiler()
+
+
+def supports_colour(stream: TextIO) -> bool:
+    """Check whether the stream is a terminal that should be coloured.
+
+    :param stream: output stream.
+    :returns: False if the stream is not a TTY or ``NO_COLOR`` is set.
+
+    """
+    try:
+        return "NO_COLOR" not in os.environ and stream.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+
+class OutputMode(Enum):
+    """Amount and format of the printed output."""
+
+    NORMAL = "normal"
+    QUIET = "quiet"
+    PORCELAIN = "porcelain"
+
+
+class Renderer(object):
+    """Buffered writer of the standard output.
+
+    Lines are collected and written to the stream at once when flushed, or
+    when the buffer grows beyond :attr:`BUFFER_SIZE` characters.
+
+    :ivar stream: stream the output is written to.
+    :ivar colours: whether to apply the styles or not.
+    :ivar mode: amount and format of the output.
+
+    """
+
+    BUFFER_SIZE: int = 1 << 16
+
+    def __init__(
+        self,
+        stream: TextIO = sys.stdout,
+        colours: Optional[bool] = None,
+        mode: OutputMode = OutputMode.NORMAL,
+    ):
+        """Renderer constructor.
+
+        :param stream: stream the output is written to.
+        :param colours: whether to apply the styles or not, by default only if
+            the stream supports them.
+        :param mode: amount and format of the output.
+
+        """
+        self.stream: TextIO = stream
+        self.colours: bool = supports_colour(stream) if colours is None else colours
+        self.mode: OutputMode = mode
+        self.__lines: List[str] = []
+        self.__size: int = 0
+
+    def write(self, text: str = "", style: str = "") -> None:
+        """Add a line to the buffer.
+
+        :param text: line text.
+        :param style: scape sequences union applied to the line.
+
+        """
+        if style:
+            text = apply_style(text, style)
+        self.__lines.append(text)
+        self.__size += len(text) + 1
+        if self.__size >= self.BUFFER_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the buffered lines to the stream."""
+        if self.__lines:
+            self.__lines.append("")
+            self.stream.write("\n".join(self.__lines))
+            self.__lines = []
+            self.__size = 0
+        self.stream.flush()
+
+
+renderer = Renderer()
+
+
 def apply_style(text: str, style: str) -> str:
     """Apply format from scape sequences.
 
+    The text is returned unchanged when :data:`renderer` has colours disabled.
+
     :param style: scape sequences union.
     :param text: text that will be styled.
 
     """
+    if not renderer.colours:
+        return text
     return f"{style}{text}{colour.reset}"
 
 
-def print_style(text: str, style: str) -> None:
+def print_style(text: str, style: str, file: Optional[TextIO] = None) -> None:
     """Print the text after applying format.
 
+    Text for the standard output is buffered in :data:`renderer`.
+
     :param style: scape sequences union.
     :param text: text that will be styled.
+    :param file: stream to print the text to instead of the standard output.
 
     """
-    print(apply_style(text, style), flush=True)
+    if file is None:
+        renderer.write(text, style)
+    else:
+        print(f"{style}{text}{colour.reset}" if supports_colour(file) else text, file=file)
+
+
+class BackstoreError(Exception):
+    """Error loading the manifest or preparing the selected files."""
 
 
 class HomeFile(NamedTuple):
@@ -103,350 +410,3547 @@ class HomeFile(NamedTuple):
     :ivar relpath: relative path of the file.
     :ivar description: brief description of the file.
     :ivar packages: required packages related to the file.
+    :ivar package_aliases: package names of each package backend, indexed by
+        the package name in :attr:`packages`.
+    :ivar template: repository relative path of the template the file is
+        rendered from, if it is generated.
+    :ivar variables: values of the template placeholders.
 
     """
 
     relpath: Path
     description: str = ""
     packages: Set[str] = set()
+    package_aliases: Dict[str, Dict[str, str]] = {}
+    template: str = ""
+    variables: Dict[str, str] = {}
 
 
-def print_selected_files(selected_files: List[HomeFile]) -> None:
-    """Print selected files.
+def source_path(file: HomeFile) -> Path:
+    """Obtain the path the file is installed from.
 
-    :param selected_files: list of selected files.
+    :param file: selected file.
+    :returns: the rendered file in :data:`BUILD_PATH` for templates, or the
+        repository file otherwise.
 
     """
+    if file.template:
+        return BUILD_PATH / (file.relpath)
+    return REPO_HOME_PATH / (file.relpath)
 
-    def color_file(file_relpath: Path) -> str:
-        """Return a colored file path string.
 
-        The color will tell the file type in the ``$HOME`` directory.
+class InstallMode(Enum):
+    """How the repository files are installed in the ``$HOME`` directory."""
 
-        :param file_relpath: home-relative file path.
-        :returns: the colored file string.
+    SYMLINK = "symlink"
+    COPY = "copy"
+    HARDLINK = "hardlink"
+    REFLINK = "reflink"
 
-        """
-        link_name_path = HOME_PATH / (file_relpath)
-        output_text = str(link_name_path)
 
-        if link_name_path.is_symlink():
-            if link_name_path.resolve() == REPO_HOME_PATH / (file_relpath):
-                style = colour.fg_cyan
-            else:
-                style = colour.fg_yellow
-                output_text = f"{output_text} (linked to wrong file)"
-        elif link_name_path.exists():
-            style = colour.fg_yellow
-            output_text = f"{output_text} (file is not link)"
-        else:
-            style = colour.fg_red
-            output_text = f"{output_text} (file does not exist)"
+class LinkState(Enum):
+    """State of a selected file in the ``$HOME`` directory."""
 
-        return apply_style(output_text, style)
+    LINKED = "linked"
+    FOLDED = "folded"
+    IDENTICAL = "identical"
+    OUTDATED = "outdated"
+    WRONG_LINK = "wrong link"
+    REGULAR = "regular"
+    MISSING = "missing"
 
-    def print_file(file: HomeFile) -> None:
-        """Print file with it appropiate format.
 
-        :param file: file to print.
+class FileState(NamedTuple):
+    """Snapshot of a selected file in the ``$HOME`` directory.
 
-        """
-        print(f"{color_file(file.relpath)}: {file.description}")
-        if file.packages:
-            print(f"└─ PKGS: {' '.join(file.packages)}")
+    :ivar state: classification of the file.
+    :ivar link_target: absolute target of the symbolic link, if any.
 
-    list(map(print_file, selected_files))
+    """
 
+    state: LinkState
+    link_target: Optional[Path] = None
 
-def link_selected_files(
-    selected_files: List[HomeFile], force: bool = False, install: bool = False
-) -> None:
-    """Link selected files.
 
-    :param selected_files: list of selected files.
-    :param force: whether to always delete the link or not.
+class DirectoryCache(object):
+    """Least recently used cache of open directory file descriptors.
+
+    Operations on a path are performed relative to the descriptor of its
+    parent directory, so the kernel does not walk the whole ``$HOME`` path on
+    every call. Each directory is opened relative to its own parent, hence
+    deep shared parents are resolved once per run. Descriptors in use are
+    reference counted and only closed once released.
+
+    Without ``dir_fd`` support the full path is used instead.
+
+    :ivar size: maximum number of unused descriptors kept open.
 
     """
 
-    def get_installed_packages() -> List[str]:
-        """Obtain the list of installed APT packages.
+    SUPPORTED: bool = hasattr(os, "O_DIRECTORY") and {
+        os.open,
+        os.stat,
+        os.readlink,
+        os.symlink,
+        os.unlink,
+    }.issubset(os.supports_dir_fd)
+    FLAGS: int = (
+        getattr(os, "O_PATH", os.O_RDONLY) | getattr(os, "O_DIRECTORY", 0) | os.O_CLOEXEC
+        if SUPPORTED
+        else 0
+    )
+
+    def __init__(self, size: int = 64):
+        """Directory cache constructor.
 
-        :returns: The installed packages with the APT package manager.
+        :param size: maximum number of unused descriptors kept open.
 
         """
-        return set(
-            map(
-                lambda package: package.split("/", 1)[0],
-                subprocess.run(
-                    ["apt", "list", "--installed"],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.DEVNULL,
-                    universal_newlines=True,
-                ).stdout.splitlines(),
-            )
-        )
+        # ``_thread`` is always loaded, unlike ``threading``
+        import _thread
 
-    def not_installed_dependencies(dependencies: List[str], installed_packages: Set[str]) -> bool:
-        return set(dependencies) - installed_packages
+        self.size = size
+        # Each entry is a list with the descriptor, its users and whether it
+        # is still cached, in least recently used order
+        self.__entries: "OrderedDict[str, List]" = OrderedDict()
+        self.__lock = _thread.allocate_lock()
 
-    def skip_link(key: str, target_path: Path, link_name_path: Path) -> bool:
-        """Check whether we should skip linking this current file.
+    def __open(self, directory: str, home: str) -> List:
+        """Obtain the cache entry of the directory, opening it if needed.
 
-        :param key: file key.
-        :param target_path: file repo full path.
-        :param link_name_path: file home full path.
-        :returns: True if we should skip the linking of this file.
+        Must be called with the lock held.
+
+        :param directory: absolute directory path.
+        :param home: ``$HOME`` directory path, where the walk starts.
+        :returns: the cache entry, already counted as used.
 
         """
-        skip = False
+        entry = self.__entries.get(directory)
+        if entry is not None:
+            self.__entries.move_to_end(directory)
+            entry[1] += 1
+            return entry
+
+        parent, name = os.path.split(directory)
+        if directory != home and directory.startswith(home):
+            parent_entry = self.__open(parent, home)
+            try:
+                fd = os.open(name, self.FLAGS, dir_fd=parent_entry[0])
+            finally:
+                self.__release(parent_entry)
+        else:
+            fd = os.open(directory, self.FLAGS)
 
-        if link_name_path.is_symlink():
-            if link_name_path.resolve() == target_path:
-                print_style(
-                    f"{key}: File `{str(link_name_path)}` is already linked.",
-                    colour.fg_green,
-                )
-            else:
-                print_style(
-                    f"{key}: File `{str(link_name_path)}` "
-                    f"is linked to `{str(link_name_path.resolve())}` "
-                    f"instead of `{str(target_path)}`. Please remove it "
-                    "manually or use --force.",
-                    colour.fg_red,
-                )
-            skip = True
-        elif link_name_path.exists():
-            print_style(
-                f"{key}: File `{str(link_name_path)}` exists and it is not a "
-                "symbolic link. Please remove it manually or use --force "
-                "argument.",
-                colour.fg_red,
-            )
-            skip = True
-        elif not link_name_path.parent.exists():
-            link_name_path.parent.mkdir(parents=True, exist_ok=True)
+        entry = self.__entries[directory] = [fd, 1, True]
+        self.__evict()
+        return entry
 
-        return skip
+    def __release(self, entry: List) -> None:
+        """Stop using a cache entry.
 
-    def link_file(file: HomeFile, installed_packages: List[str], force: bool = False) -> None:
-        """Create a link of the file.
+        Must be called with the lock held.
 
-        :param file: file to link.
-        :param force: whether to always delete the link or not.
+        :param entry: cache entry.
 
         """
-        key = apply_style(file.relpath, colour.bold)
-        target_path = REPO_HOME_PATH / (file.relpath)
-        link_name_path = HOME_PATH / (file.relpath)
+        entry[1] -= 1
+        if not entry[2] and not entry[1]:
+            os.close(entry[0])
 
-        not_installed_package_deps = not_installed_dependencies(file.packages, installed_packages)
-        if not_installed_package_deps:
-            print_style(
-                f"{key}: Missing some dependencies for the selected file: {not_installed_package_deps}",
-                colour.fg_yellow,
-            )
+    def __evict(self) -> None:
+        """Close the least recently used unused descriptors over the limit.
 
-        if force:
-            try:
-                link_name_path.unlink()
-            except FileNotFoundError:
-                pass
-        elif skip_link(key, target_path, link_name_path):
+        Must be called with the lock held.
+
+        """
+        excess = len(self.__entries) - self.size
+        if excess <= 0:
             return
 
-        link_name_path.symlink_to(target_path, target_path.is_dir())
-        print_style(
-            f"{key}: File `{str(link_name_path)}` linked correctly.",
-            colour.fg_green,
-        )
+        for directory, entry in list(self.__entries.items()):
+            if not entry[1]:
+                del self.__entries[directory]
+                os.close(entry[0])
+                excess -= 1
+                if not excess:
+                    break
 
-    list(
-        map(
-            functools.partial(
-                link_file,
-                installed_packages=get_installed_packages(),
-                force=force,
-            ),
-            selected_files,
-        )
-    )
+    def acquire(self, path: str) -> Tuple[Optional[int], str, Optional[List]]:
+        """Open the parent directory of the path until it is released.
 
+        :param path: absolute path.
+        :returns: the parent directory descriptor and the path name, to be
+            passed as the ``dir_fd`` and path of :mod:`os` functions, and the
+            cache entry to release.
 
-def delete_selected_links(selected_files: List[HomeFile], force: bool = False) -> None:
-    """Delete selected files.
+        """
+        if not self.SUPPORTED:
+            return None, path, None
 
-    :param selected_files: list of selected files.
-    :param force: whether to always delete the link or not.
+        directory, name = os.path.split(path)
+        with self.__lock:
+            entry = self.__open(directory, str(HOME_PATH))
+        return entry[0], name, entry
 
-    """
+    def release(self, entry: Optional[List]) -> None:
+        """Stop using a parent directory obtained with :meth:`acquire`.
+
+        :param entry: cache entry.
 
-    def skip_link(key: str, target_path: Path, link_name_path: Path) -> bool:
-        """Check whether we should skip deleting this current file link.
+        """
+        if entry is not None:
+            with self.__lock:
+                self.__release(entry)
+
+    def invalidate(self, path: Path) -> None:
+        """Forget the directory and everything below it.
 
-        :param key: file key.
-        :param target_path: file repo full path.
-        :param link_name_path: file home full path.
-        :returns: True if we should skip the deleting of this file link.
+        Must be called whenever a cached directory may be replaced, so no
+        descriptor keeps pointing to the previous one.
+
+        :param path: absolute directory path.
 
         """
-        skip = False
+        directory = str(path)
+        prefix = os.path.join(directory, "")
 
-        if link_name_path.is_symlink():
-            if link_name_path.resolve() != target_path:
-                print_style(
-                    f"{key}: File `{str(link_name_path)}` "
-                    f"is linked to `{str(link_name_path.resolve())}` "
-                    f"instead of `{str(target_path)}`. Please remove it "
-                    "manually or use --force argument.",
-                    colour.fg_red,
-                )
-                skip = True
-        elif link_name_path.exists():
-            print_style(
-                f"{key}: File `{str(link_name_path)}` exists and it is not a "
-                "symbolic link. Use --force to delete it.",
-                colour.fg_red,
-            )
-            skip = True
-        else:
-            print_style(
-                f"{key}: File `{str(link_name_path)}` does not exist.",
-                colour.fg_yellow,
-            )
-            skip = True
+        with self.__lock:
+            for cached_directory in list(self.__entries):
+                if cached_directory == directory or cached_directory.startswith(prefix):
+                    entry = self.__entries.pop(cached_directory)
+                    entry[2] = False
+                    if not entry[1]:
+                        os.close(entry[0])
 
-        return skip
+    def clear(self) -> None:
+        """Close every unused descriptor and forget the used ones."""
+        self.invalidate(Path("/"))
 
-    def delete_link(file: HomeFile, force: bool = False) -> None:
-        """Create a link of the file.
 
-        :param file: file to link.
+directory_cache = DirectoryCache()
 
-        """
-        key = apply_style(file.relpath, colour.bold)
-        target_path = REPO_HOME_PATH / (file.relpath)
-        link_name_path = HOME_PATH / (file.relpath)
 
-        if not force and skip_link(key, target_path, link_name_path):
-            return
+def is_folded_file(file: HomeFile, stat_result: os.stat_result) -> bool:
+    """Check whether the file is the repository one reached through a folded
+    parent directory link.
 
-        try:
-            link_name_path.unlink()
-        except FileNotFoundError:
-            pass
+    :param file: file to check.
+    :param stat_result: ``lstat`` result of the file in the ``$HOME`` directory.
+    :returns: True if a parent directory of the file is linked to the
+        repository.
 
-        print_style(
-            f"{key}: File `{str(link_name_path)}` deleted correctly.",
-            colour.fg_green,
-        )
+    """
+    target_path = source_path(file)
 
-    print_selected_files(selected_files)
-    question = input("\nAre you sure you want to delete previous links? (yes/no): ")
+    try:
+        repo_stat = os.lstat(target_path)
+    except (FileNotFoundError, NotADirectoryError):
+        return False
 
-    if question.strip().lower() != "yes":
-        print("\nAborting symlinks deletion.")
-        return
+    if (repo_stat.st_dev, repo_stat.st_ino) != (stat_result.st_dev, stat_result.st_ino):
+        return False
 
-    list(map(functools.partial(delete_link, force=force), selected_files))
+    return os.path.realpath(HOME_PATH / (file.relpath)) == str(target_path)
 
 
-def load_files_list(args: Namespace) -> List[HomeFile]:
-    """Load selected files.
+def hash_file(path: Path) -> str:
+    """Obtain the SHA-256 digest of the file contents.
+
+    The file is mapped in memory and hashed from the page cache without being
+    copied into Python buffers.
 
-    :param load_all: whether to select all files located in
-        :data:`ALL_FILES_PATH`.
+    :param path: file to hash.
+    :returns: the hexadecimal digest.
 
     """
-    # Load all files metadata
-    with ALL_FILES_PATH.open() as f:
-        try:
-            all_files = json.load(f)
-        except json.JSONDecodeError:
-            sys.exit(f"ERROR: Problem decoding `{str(ALL_FILES_PATH)}` file")
+    import hashlib
+    import mmap
 
-    # Obtain selected keys
-    if args.all:
-        selected_files = list(all_files)
-    elif args.only:
-        selected_files = [args.only]
-    else:
-        with SEL_FILES_PATH.open() as f:
-            selected_files = list(map(str.strip, f.read().splitlines()))
+    with open(path, "rb", buffering=0) as f:
+        if not os.fstat(f.fileno()).st_size:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+            return hashlib.sha256(mapped_file).hexdigest()
 
-    chosen_files: List[HomeFile] = []
 
-    # Create a list of selected files
-    for file_path in selected_files:
+def is_identical(source: Path, destination: Path) -> bool:
+    """Check whether the destination is an exact copy of the source.
+
+    Files are compared by inode first, then by size and finally by content
+    hash. Directories must hold the same entries and symbolic links the same
+    target.
+
+    :param source: repository path.
+    :param destination: ``$HOME`` path.
+    :returns: True if both paths have the same contents.
+
+    """
+    try:
+        source_stat = os.lstat(source)
+        destination_stat = os.lstat(destination)
+    except (FileNotFoundError, NotADirectoryError):
+        return False
+
+    if stat.S_IFMT(source_stat.st_mode) != stat.S_IFMT(destination_stat.st_mode):
+        return False
+    elif stat.S_ISLNK(source_stat.st_mode):
+        return os.readlink(source) == os.readlink(destination)
+    elif stat.S_ISDIR(source_stat.st_mode):
+        source_names = sorted(os.listdir(source))
+        return source_names == sorted(os.listdir(destination)) and all(
+            is_identical(source / name, destination / name) for name in source_names
+        )
+    elif (source_stat.st_dev, source_stat.st_ino) == (
+        destination_stat.st_dev,
+        destination_stat.st_ino,
+    ):
+        return True
+
+    return source_stat.st_size == destination_stat.st_size and hash_file(source) == hash_file(
+        destination
+    )
+
+
+def read_file_state(file: HomeFile, mode: InstallMode = InstallMode.SYMLINK) -> FileState:
+    """Classify the file with a single ``lstat`` (and ``readlink`` for links).
+
+    The link target is compared against the repository file instead of
+    resolving the whole symbolic link chain. When installing copies, regular
+    files are compared with the repository ones by content.
+
+    :param file: file to inspect.
+    :param mode: how the file is installed.
+    :returns: the state of the file in the ``$HOME`` directory.
+
+    """
+    link_name = os.path.join(HOME_PATH, file.relpath)
+
+    try:
+        dir_fd, name, entry = directory_cache.acquire(link_name)
         try:
-            chosen_files.append(HomeFile(file_path, **all_files[file_path]))
-        except KeyError:
-            sys.exit(f"ERROR: `{file_path}` was not found in `{str(ALL_FILES_PATH)}` file")
-        except TypeError as error:
-            sys.exit(f"ERROR parsing `{file_path}`: {str(error)}.")
+            stat_result = os.lstat(name, dir_fd=dir_fd)
+            is_link = stat.S_ISLNK(stat_result.st_mode)
+            link = os.readlink(name, dir_fd=dir_fd) if is_link else ""
+        finally:
+            directory_cache.release(entry)
+    except (FileNotFoundError, NotADirectoryError):
+        return FileState(LinkState.MISSING)
+
+    if not is_link:
+        if is_folded_file(file, stat_result):
+            return FileState(LinkState.FOLDED)
+        if mode != InstallMode.SYMLINK and is_identical(source_path(file), Path(link_name)):
+            return FileState(LinkState.IDENTICAL)
+        return FileState(LinkState.REGULAR)
+
+    link_target = Path(os.path.normpath(os.path.join(os.path.dirname(link_name), link)))
+    if link_target == source_path(file):
+        return FileState(LinkState.LINKED, link_target)
+
+    return FileState(LinkState.WRONG_LINK, link_target)
+
+
+def map_files(function: Callable, selected_files: Iterable, jobs: int = 1) -> Iterator:
+    """Apply the function to every selected file.
 
-    # Check if every selected file exists in the repository if we are not
-    # deleting
-    if not args.delete:
+    When more than one job is requested the files are processed by a bounded
+    thread pool. Results are always yielded in the selection order.
+
+    :param function: per-file worker.
+    :param selected_files: list of selected files.
+    :param jobs: maximum number of files processed at the same time.
+    :returns: an iterator over the results of each file.
+
+    """
+    if jobs <= 1:
+        yield from map(function, selected_files)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    # Submit only a window of files, so closing the iterator early leaves the
+    # rest of them untouched
+    files = iter(selected_files)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = deque(executor.submit(function, file) for _, file in zip(range(jobs * 2), files))
         try:
-            list(
-                map(
-                    lambda file: (REPO_HOME_PATH / file.relpath).resolve(strict=True),
-                    chosen_files,
-                )
+            while pending:
+                result = pending.popleft().result()
+                for file in files:
+                    pending.append(executor.submit(function, file))
+                    break
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def snapshot_files(
+    selected_files: List[HomeFile], jobs: int = 1, mode: InstallMode = InstallMode.SYMLINK
+) -> Dict[str, FileState]:
+    """Obtain the state of every selected file once per run.
+
+    :param selected_files: list of selected files.
+    :param jobs: maximum number of files inspected at the same time.
+    :param mode: how the files are installed.
+    :returns: the state of each file indexed by its relative path.
+
+    """
+    read_state = profiler.timed(
+        functools.partial(read_file_state, mode=mode), lambda file: file.relpath
+    )
+
+    with profiler.phase("state resolution"):
+        return dict(
+            zip(
+                (file.relpath for file in selected_files),
+                map_files(read_state, selected_files, jobs),
             )
-        except FileNotFoundError as error:
-            sys.exit(f"ERROR: File `{error.filename}` from selected files does not exist.")
+        )
 
-    return sorted(chosen_files, key=lambda file: file.relpath)
 
+def copy_file(source: Path, destination: Path, reflink: bool = False) -> None:
+    """Copy the file contents inside the kernel.
 
-def main():
-    parser = argparse.ArgumentParser(
-        description=__doc__,
-        formatter_class=argparse.RawDescriptionHelpFormatter,
-    )
-    actions_group = parser.add_mutually_exclusive_group(required=True)
-    actions_group.add_argument("-p", "--print", action="store_true", help="print selected files")
-    actions_group.add_argument("-l", "--link", action="store_true", help="link selected files")
-    actions_group.add_argument(
-        "-d",
-        "--delete",
-        action="store_true",
-        help="delete selected local symlinks",
-    )
-    parser.add_argument(
-        "-f",
-        "--force",
-        action="store_true",
-        help="force linking and deleting symlinks",
-    )
-    number_group = parser.add_mutually_exclusive_group(required=False)
-    number_group.add_argument(
-        "-a", "--all", action="store_true", help="perform action for all files"
-    )
-    number_group.add_argument(
-        "-o",
-        "--only",
-        action="store",
-        metavar="key",
-        help="perform action only for a selected key",
-    )
+    Reflinks are tried first if requested, sharing the data blocks on
+    filesystems supporting them. Otherwise the data is copied with
+    :func:`os.copy_file_range`, or :func:`os.sendfile` where the former is not
+    available, so it never goes through Python buffers.
 
-    args = parser.parse_args()
-    selected_files = load_files_list(args)
+    :param source: file to copy.
+    :param destination: new file path.
 
-    if not selected_files:
-        sys.exit("ERROR: There aren't selected files.")
+    """
+    import errno
+    import shutil
 
-    if args.print:
-        print(f"Listing selected files.\n")
-        print_selected_files(selected_files)
-    elif args.link:
-        print(f"Linking selected files.\n")
-        link_selected_files(selected_files, args.force)
+    with open(source, "rb") as source_file, open(destination, "xb") as destination_file:
+        source_fd = source_file.fileno()
+        destination_fd = destination_file.fileno()
+
+        if reflink:
+            import fcntl
+
+            try:
+                fcntl.ioctl(destination_fd, FICLONE, source_fd)
+            except OSError:
+                pass
+            else:
+                shutil.copymode(source, destination)
+                return
+
+        size = os.fstat(source_fd).st_size
+        copied = 0
+
+        with contextlib.suppress(AttributeError):
+            try:
+                while copied < size:
+                    copied_bytes = os.copy_file_range(source_fd, destination_fd, size - copied)
+                    if not copied_bytes:
+                        break
+                    copied += copied_bytes
+            except OSError as error:
+                if error.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+
+        while copied < size:
+            copied_bytes = os.sendfile(destination_fd, source_fd, copied, size - copied)
+            if not copied_bytes:
+                break
+            copied += copied_bytes
+
+    shutil.copymode(source, destination)
+
+
+def install_path(source: Path, destination: Path, mode: InstallMode) -> None:
+    """Install the repository path in the ``$HOME`` directory.
+
+    Directories are recreated entry by entry for every mode but symbolic
+    links, and symbolic links inside them are copied as they are.
+
+    :param source: repository path.
+    :param destination: ``$HOME`` path.
+    :param mode: how the path is installed.
+
+    """
+    if mode == InstallMode.SYMLINK:
+        dir_fd, name, entry = directory_cache.acquire(str(destination))
+        try:
+            # Whether the target is a directory only matters on Windows,
+            # which has no ``dir_fd`` support
+            os.symlink(source, name, dir_fd is None and source.is_dir(), dir_fd=dir_fd)
+        finally:
+            directory_cache.release(entry)
+    elif source.is_symlink():
+        os.symlink(os.readlink(source), destination)
+    elif source.is_dir():
+        destination.mkdir()
+        with os.scandir(source) as entries:
+            for entry in entries:
+                install_path(Path(entry.path), destination / entry.name, mode)
+    elif mode == InstallMode.HARDLINK:
+        os.link(source, destination)
+    else:
+        copy_file(source, destination, reflink=mode == InstallMode.REFLINK)
+
+
+def backup_path(relpath: str) -> Optional[str]:
+    """Move the ``$HOME`` path into the backup store before it is replaced.
+
+    Regular files are stored once per content under ``objects`` in
+    :data:`BACKUP_PATH`, named after their digest, and symbolic links are
+    only recorded. Each backup is appended to the store index. Other file
+    types are just removed.
+
+    :param relpath: home-relative path of the file.
+    :returns: the digest of the stored contents or the link target, or None
+        if nothing was backed up.
+
+    """
+    import errno
+    import json
+
+    link_name_path = HOME_PATH / relpath
+
+    try:
+        stat_result = os.lstat(link_name_path)
+    except FileNotFoundError:
+        return None
+
+    record = {"home": str(HOME_PATH), "path": relpath, "time": time.time()}
+
+    if stat.S_ISLNK(stat_result.st_mode):
+        record["target"] = backup = os.readlink(link_name_path)
+        link_name_path.unlink()
+    elif stat.S_ISREG(stat_result.st_mode):
+        record["object"] = backup = hash_file(link_name_path)
+        record["mode"] = stat.S_IMODE(stat_result.st_mode)
+        object_path = BACKUP_PATH / "objects" / backup[:2] / backup[2:]
+        if object_path.exists():
+            link_name_path.unlink()
+        else:
+            object_path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.replace(link_name_path, object_path)
+            except OSError as error:
+                if error.errno != errno.EXDEV:
+                    raise
+                import shutil
+
+                shutil.copyfile(link_name_path, object_path)
+                link_name_path.unlink()
+    else:
+        link_name_path.unlink()
+        return None
+
+    # Appends of a single line are atomic, so concurrent backups do not mix
+    BACKUP_PATH.mkdir(exist_ok=True)
+    index_fd = os.open(BACKUP_PATH / "index.ndjson", os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+    try:
+        os.write(index_fd, f"{json.dumps(record)}\n".encode())
+    finally:
+        os.close(index_fd)
+
+    return backup
+
+
+def load_backups() -> Dict[str, Dict]:
+    """Load the latest backup of each path of the ``$HOME`` directory.
+
+    :returns: the backup records indexed by their home-relative path.
+
+    """
+    import json
+
+    backups: Dict[str, Dict] = {}
+
+    with contextlib.suppress(FileNotFoundError), (BACKUP_PATH / "index.ndjson").open() as f:
+        for line in f:
+            with contextlib.suppress(ValueError):
+                record = json.loads(line)
+                if record.get("home") == str(HOME_PATH):
+                    backups[record["path"]] = record
+
+    return backups
+
+
+def render_template(file: HomeFile, renders: Dict[str, Dict]) -> Optional[Dict]:
+    """Render the template of the file into :data:`BUILD_PATH`.
+
+    As make does, the template is only rendered again when its inputs or the
+    rendered file changed since the previous render. Modification times are
+    checked first and contents hashed only when they differ, so touching a
+    template without changing it does not render it again.
+
+    :param file: generated file.
+    :param renders: records of the previous renders indexed by relative path.
+    :returns: the new render record, or None if the previous one is still
+        valid.
+
+    """
+    import hashlib
+    import json
+
+    from string import Template
+
+    template_path = REPO_HOME_PATH / file.template
+    output_path = BUILD_PATH / (file.relpath)
+    record = renders.get(file.relpath, {})
+    template_stat = template_path.stat()
+    variables = json.dumps(file.variables, sort_keys=True)
+
+    try:
+        output_stat = output_path.stat()
+        output_stamp = [output_stat.st_mtime_ns, output_stat.st_size]
+    except FileNotFoundError:
+        output_stamp = None
+
+    template_stamp = [template_stat.st_mtime_ns, template_stat.st_size]
+    if (
+        output_stamp is not None
+        and record.get("template_stamp") == template_stamp
+        and record.get("output_stamp") == output_stamp
+        and record.get("variables") == variables
+    ):
+        return None
+
+    template_text = template_path.read_text()
+    inputs = hashlib.sha256(f"{file.template}\0{variables}\0{template_text}".encode()).hexdigest()
+    if (
+        output_stamp is not None
+        and record.get("inputs") == inputs
+        and record.get("output") == hash_file(output_path)
+    ):
+        return dict(record, template_stamp=template_stamp, output_stamp=output_stamp)
+
+    try:
+        rendered_text = Template(template_text).substitute(file.variables)
+    except KeyError as error:
+        raise BackstoreError(
+            f"Template `{file.template}` of `{file.relpath}` uses the undefined "
+            f"variable {str(error)}."
+        )
+    except ValueError as error:
+        raise BackstoreError(
+            f"Problem parsing template `{file.template}` of `{file.relpath}`: {str(error)}."
+        )
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = output_path.with_name(f".{output_path.name}.{os.getpid()}.tmp")
+    temporary_path.write_text(rendered_text)
+    os.chmod(temporary_path, stat.S_IMODE(template_stat.st_mode))
+    os.replace(temporary_path, output_path)
+    output_stat = output_path.stat()
+
+    return {
+        "template_stamp": template_stamp,
+        "variables": variables,
+        "inputs": inputs,
+        "output": hashlib.sha256(rendered_text.encode()).hexdigest(),
+        "output_stamp": [output_stat.st_mtime_ns, output_stat.st_size],
+    }
+
+
+def render_templates(selected_files: List[HomeFile], jobs: int = 1) -> None:
+    """Render the templates of the generated files whose inputs changed.
+
+    The render records are kept in :data:`BUILD_PATH` next to the rendered
+    files.
+
+    :param selected_files: list of selected files.
+    :param jobs: maximum number of templates rendered at the same time.
+
+    """
+    import json
+
+    templated_files = [file for file in selected_files if file.template]
+    if not templated_files:
+        return
+
+    renders_path = BUILD_PATH / ".renders.json"
+    renders: Dict[str, Dict] = {}
+    with contextlib.suppress(OSError, ValueError), renders_path.open() as f:
+        renders = json.load(f)
+
+    render = functools.partial(render_template, renders=renders)
+    new_records = {
+        file.relpath: record
+        for file, record in zip(templated_files, map_files(render, templated_files, jobs))
+        if record is not None
+    }
+
+    if new_records:
+        renders.update(new_records)
+        temporary_path = renders_path.with_name(f".renders.{os.getpid()}.tmp")
+        with temporary_path.open("w") as f:
+            json.dump(renders, f)
+        os.replace(temporary_path, renders_path)
+
+
+@functools.lru_cache(maxsize=None)
+def list_repo_directory(relpath: str) -> Optional[Tuple[str, ...]]:
+    """List the entries of a repository directory.
+
+    :param relpath: home-relative path of the directory.
+    :returns: the names of the directory entries, or None if it is not a
+        directory.
+
+    """
+    try:
+        with os.scandir(REPO_HOME_PATH / relpath) as entries:
+            return tuple(sorted(entry.name for entry in entries))
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+class RepoIndex(NamedTuple):
+    """Paths of the home directory of the repository.
+
+    :ivar files: home-relative paths of the files and symbolic links.
+    :ivar directories: home-relative paths of the directories holding them.
+
+    """
+
+    files: Set[str]
+    directories: Set[str]
+
+    def exists(self, relpath: str) -> bool:
+        """Check whether the repository path exists.
+
+        Paths missing from the index, such as files ignored by git, are
+        checked in the filesystem.
+
+        :param relpath: home-relative path.
+        :returns: True if the path exists.
+
+        """
+        return (
+            relpath in self.files
+            or relpath in self.directories
+            or os.path.lexists(REPO_HOME_PATH / relpath)
+        )
+
+
+def list_git_files() -> Optional[List[str]]:
+    """List the repository files with ``git ls-files``.
+
+    Tracked files deleted from the working tree are left out, and untracked
+    files are included unless git ignores them.
+
+    :returns: the home-relative paths of the files, or None if the repository
+        is not a git repository or git is not available.
+
+    """
+    import shutil
+    import subprocess
+
+    if not (REPO_HOME_PATH.parent / ".git").exists() or shutil.which("git") is None:
+        return None
+
+    try:
+        output = subprocess.run(
+            ["git", "ls-files", "-z", "-t", "--cached", "--deleted", "--others"]
+            + ["--exclude-standard"],
+            cwd=REPO_HOME_PATH,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        ).stdout.decode()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    files: Dict[str, bool] = {}
+    for entry in filter(None, output.split("\0")):
+        tag, relpath = entry.split(" ", 1)
+        files[relpath] = files.get(relpath, True) and tag != "R"
+
+    return [relpath for relpath, exists in files.items() if exists]
+
+
+def scan_repo_files() -> List[str]:
+    """List the repository files walking the home directory with ``scandir``.
+
+    :returns: the home-relative paths of the files and symbolic links.
+
+    """
+    files: List[str] = []
+    pending_directories = [""]
+
+    while pending_directories:
+        directory = pending_directories.pop()
+        with os.scandir(REPO_HOME_PATH / directory) as entries:
+            for entry in entries:
+                relpath = os.path.join(directory, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    pending_directories.append(relpath)
+                else:
+                    files.append(relpath)
+
+    return files
+
+
+@functools.lru_cache(maxsize=None)
+def index_repo_tree(use_git: bool = False) -> RepoIndex:
+    """Index the home directory of the repository once per run.
+
+    Files are listed with a single walk of the directory, which is cheaper
+    than running git, or by git if requested and possible, so ignored files
+    are left out.
+
+    :param use_git: whether to list the files with git or not.
+    :returns: the repository index.
+
+    """
+    files = list_git_files() if use_git else None
+    if files is None:
+        files = scan_repo_files()
+
+    directories: Set[str] = set()
+    for relpath in files:
+        parent = os.path.dirname(relpath)
+        while parent and parent not in directories:
+            directories.add(parent)
+            parent = os.path.dirname(parent)
+
+    return RepoIndex(set(files), directories)
+
+
+def is_folded_link(relpath: str) -> bool:
+    """Check whether the ``$HOME`` path is a link to the same repository path.
+
+    :param relpath: home-relative path to check.
+    :returns: True if the path is a symbolic link to the repository.
+
+    """
+    link_name_path = HOME_PATH / relpath
+
+    try:
+        link_target = os.readlink(link_name_path)
+    except OSError:
+        return False
+
+    return os.path.normpath(os.path.join(link_name_path.parent, link_target)) == str(
+        REPO_HOME_PATH / relpath
+    )
+
+
+def fold_files(selected_files: List[HomeFile], deleting: bool = False) -> List[HomeFile]:
+    """Replace files sharing a fully managed directory with the directory.
+
+    As GNU stow does, a repository directory whose every entry is selected is
+    linked once instead of linking each entry. A directory is only folded if
+    its ``$HOME`` counterpart does not exist yet or is already folded. When
+    deleting, only already folded directories are taken into account.
+
+    :param selected_files: list of selected files.
+    :param deleting: whether the files are going to be deleted or not.
+    :returns: the selected files with the foldable ones replaced by their
+        directory.
+
+    """
+    selected_relpaths = {file.relpath for file in selected_files if not file.template}
+    # Rendered files are linked inside their parents, so those can not be folded
+    rendered_parents = {
+        str(parent)
+        for file in selected_files
+        if file.template
+        for parent in Path(file.relpath).parents
+    }
+    managed_cache: Dict[str, bool] = {}
+    foldable_cache: Dict[str, bool] = {}
+
+    def is_managed(relpath: str) -> bool:
+        """Check whether every entry below the repository path is selected.
+
+        :param relpath: home-relative path to check.
+        :returns: True if the path is selected or every entry below it is.
+
+        """
+        if relpath not in managed_cache:
+            children = list_repo_directory(relpath)
+            managed_cache[relpath] = relpath in selected_relpaths or (
+                bool(children)
+                and all(is_managed(os.path.join(relpath, child)) for child in children)
+            )
+        return managed_cache[relpath]
+
+    def is_foldable(relpath: str) -> bool:
+        """Check whether the directory can be linked as a whole.
+
+        :param relpath: home-relative path of the directory.
+        :returns: True if the directory can be folded.
+
+        """
+        if relpath not in foldable_cache:
+            if relpath in rendered_parents:
+                foldable = False
+            elif is_folded_link(relpath):
+                foldable = True
+            elif deleting:
+                foldable = False
+            else:
+                foldable = not os.path.lexists(HOME_PATH / relpath)
+            foldable_cache[relpath] = foldable and is_managed(relpath)
+        return foldable_cache[relpath]
+
+    folds: Dict[str, List[HomeFile]] = {}
+    folded_files: List[HomeFile] = []
+
+    for file in selected_files:
+        parts = Path(file.relpath).parts
+        for depth in range(1, len(parts)):
+            directory = os.path.join(*parts[:depth])
+            if is_foldable(directory):
+                folds.setdefault(directory, []).append(file)
+                break
+        else:
+            folded_files.append(file)
+
+    for directory, files in folds.items():
+        folded_files.append(
+            HomeFile(
+                directory,
+                f"Folded directory of {len(files)} selected files.",
+                sorted({package for file in files for package in file.packages}),
+                {
+                    backend: aliases
+                    for file in files
+                    for backend, aliases in file.package_aliases.items()
+                },
+            )
+        )
+
+    return sorted(folded_files, key=lambda file: file.relpath)
+
+
+def unfold_parents(relpath: str) -> None:
+    """Split the folded parent directories of the file into per-entry links.
+
+    Every folded parent directory link is replaced by a real directory
+    containing a link for each entry of the repository directory.
+
+    :param relpath: home-relative path of the file.
+
+    """
+    parts = Path(relpath).parts
+
+    for depth in range(1, len(parts)):
+        directory = os.path.join(*parts[:depth])
+        if not is_folded_link(directory):
+            continue
+
+        link_name_path = HOME_PATH / directory
+        directory_cache.invalidate(link_name_path)
+        link_name_path.unlink()
+        link_name_path.mkdir()
+        for child in list_repo_directory(directory) or ():
+            os.symlink(REPO_HOME_PATH / directory / child, link_name_path / child)
+
+
+def print_selected_files(selected_files: List[HomeFile], states: Dict[str, FileState]) -> None:
+    """Print selected files.
+
+    :param selected_files: list of selected files.
+    :param states: state of each selected file.
+
+    """
+
+    def color_file(file_relpath: Path) -> str:
+        """Return a colored file path string.
+
+        The color will tell the file type in the ``$HOME`` directory.
+
+        :param file_relpath: home-relative file path.
+        :returns: the colored file string.
+
+        """
+        link_name_path = HOME_PATH / (file_relpath)
+        output_text = str(link_name_path)
+        file_state = states[file_relpath]
+
+        if file_state.state == LinkState.LINKED:
+            style = colour.fg_cyan
+        elif file_state.state == LinkState.FOLDED:
+            style = colour.fg_cyan
+            output_text = f"{output_text} (linked through parent directory)"
+        elif file_state.state == LinkState.IDENTICAL:
+            style = colour.fg_cyan
+            output_text = f"{output_text} (identical copy)"
+        elif file_state.state == LinkState.OUTDATED:
+            style = colour.fg_yellow
+            output_text = f"{output_text} (outdated copy)"
+        elif file_state.state == LinkState.WRONG_LINK:
+            style = colour.fg_yellow
+            output_text = f"{output_text} (linked to wrong file)"
+        elif file_state.state == LinkState.REGULAR:
+            style = colour.fg_yellow
+            output_text = f"{output_text} (file is not link)"
+        else:
+            style = colour.fg_red
+            output_text = f"{output_text} (file does not exist)"
+
+        return apply_style(output_text, style)
+
+    if renderer.mode == OutputMode.NORMAL:
+        for file in selected_files:
+            renderer.write(f"{color_file(file.relpath)}: {file.description}")
+            if file.packages:
+                renderer.write(f"└─ PKGS: {' '.join(file.packages)}")
+        renderer.flush()
+        return
+
+    counts: Counter = Counter()
+    for file in selected_files:
+        file_state = states[file.relpath]
+        counts[file_state.state] += 1
+        if file_state.state in (LinkState.LINKED, LinkState.FOLDED, LinkState.IDENTICAL):
+            continue
+        if renderer.mode == OutputMode.PORCELAIN:
+            renderer.write(f"{file_state.state.name.lower()}\t{file.relpath}")
+        else:
+            renderer.write(color_file(file.relpath))
+
+    print_counts(counts, LinkState)
+
+
+def read_dpkg_status(status_path: Path) -> Set[str]:
+    """Stream the dpkg status file collecting the installed packages.
+
+    :param status_path: path of the dpkg status file.
+    :returns: the names of the installed packages and the ones they provide.
+
+    """
+    import itertools
+
+    installed_packages: Set[str] = set()
+    package = None
+    installed = False
+    provides: List[str] = []
+
+    with status_path.open(encoding="utf-8", errors="replace") as f:
+        # The fields of a stanza come in any order, so its packages are only
+        # added once it ends
+        for line in itertools.chain(f, [""]):
+            if line.startswith("Package:"):
+                package = line[8:].strip()
+            elif line.startswith("Provides:"):
+                provides = [name.split()[0] for name in line[9:].split(",") if name.strip()]
+            elif line.startswith("Status:"):
+                installed = line.split()[-1] == "installed"
+            elif not line.strip():
+                if package and installed:
+                    installed_packages.add(package)
+                    installed_packages.update(provides)
+                package = None
+                installed = False
+                provides = []
+
+    return installed_packages
+
+
+def read_pacman_local(local_path: Path) -> Set[str]:
+    """Read the ``desc`` file of every package of the pacman local database.
+
+    :param local_path: path of the pacman local database directory.
+    :returns: the names of the installed packages and the ones they provide.
+
+    """
+    installed_packages: Set[str] = set()
+
+    with os.scandir(local_path) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            section = None
+            with contextlib.suppress(FileNotFoundError), open(
+                os.path.join(entry.path, "desc"), encoding="utf-8", errors="replace"
+            ) as f:
+                for line in f:
+                    line = line.strip()
+                    if line.startswith("%") and line.endswith("%"):
+                        section = line
+                    elif line and section in ("%NAME%", "%PROVIDES%"):
+                        installed_packages.add(line.split("=", 1)[0])
+
+    return installed_packages
+
+
+def read_apk_installed(installed_path: Path) -> Set[str]:
+    """Stream the Alpine apk installed database.
+
+    :param installed_path: path of the apk installed database.
+    :returns: the names of the installed packages and the ones they provide.
+
+    """
+    installed_packages: Set[str] = set()
+
+    with installed_path.open(encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line.startswith("P:"):
+                installed_packages.add(line[2:].strip())
+            elif line.startswith("p:"):
+                installed_packages.update(name.split("=", 1)[0] for name in line[2:].split())
+
+    return installed_packages
+
+
+class PackageBackend(NamedTuple):
+    """Local package database reader.
+
+    :ivar name: backend identifier, also used for the manifest aliases.
+    :ivar database_path: path of the local package database.
+    :ivar reader: callable parsing the database into the installed packages.
+    :ivar install_command: package manager command installing the packages
+        given after it.
+
+    """
+
+    name: str
+    database_path: Path
+    reader: Callable[[Path], Set[str]]
+    install_command: Tuple[str, ...]
+
+
+PACKAGE_BACKENDS: Tuple[PackageBackend, ...] = (
+    PackageBackend(
+        "dpkg",
+        Path("/var/lib/dpkg/status"),
+        read_dpkg_status,
+        ("apt-get", "install", "--yes", "--no-install-recommends"),
+    ),
+    PackageBackend(
+        "pacman",
+        Path("/var/lib/pacman/local"),
+        read_pacman_local,
+        ("pacman", "--sync", "--needed", "--noconfirm"),
+    ),
+    PackageBackend(
+        "apk", Path("/lib/apk/db/installed"), read_apk_installed, ("apk", "add", "--no-progress")
+    ),
+)
+
+
+class PackageDatabase(object):
+    """Installed packages of a backend, loaded on the first query.
+
+    The parsed packages are cached in :data:`CACHE_PATH` and reused while the
+    modification time and size of the backend database do not change.
+
+    :ivar backend: backend reading the database.
+    :cvar CACHE_VERSION: version of the cached packages, increased whenever
+        the backend readers change what they collect.
+
+    """
+
+    CACHE_VERSION: int = 2
+
+    def __init__(self, backend: PackageBackend, packages: Optional[Set[str]] = None):
+        """Package database constructor.
+
+        :param backend: backend reading the database.
+        :param packages: already loaded installed packages, if any.
+
+        """
+        self.backend: PackageBackend = backend
+        self.__packages: Optional[Set[str]] = packages
+        self.__future: Optional["Future[Set[str]]"] = None
+
+    def __getstate__(self) -> Dict:
+        """Obtain the state sent to other processes, without the background
+        load, which can not be pickled.
+
+        :returns: the backend and the installed packages, if already loaded.
+
+        """
+        packages = self.__packages
+        if packages is None and self.__future is not None and self.__future.done():
+            packages = self.__future.result()
+        return {"backend": self.backend, "packages": packages}
+
+    def __setstate__(self, state: Dict) -> None:
+        """Restore the state received from other process.
+
+        :param state: the backend and the installed packages, if loaded.
+
+        """
+        self.__init__(state["backend"], state["packages"])
+
+    @property
+    def packages(self) -> Set[str]:
+        """Installed packages, loaded on first access."""
+        return self.load()
+
+    def load(self) -> Set[str]:
+        """Load the installed packages, parsing the database or waiting for
+        :meth:`prefetch` to parse it the first time.
+
+        :returns: the installed packages.
+
+        """
+        if self.__packages is None:
+            if self.__future is not None:
+                self.__packages = self.__future.result()
+            else:
+                self.__packages = self.__load()
+        return self.__packages
+
+    def prefetch(self) -> None:
+        """Start loading the installed packages in a background thread."""
+        if self.__packages is not None or self.__future is not None:
+            return
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.__future = executor.submit(self.__load)
+        executor.shutdown(wait=False)
+
+    def __load(self) -> Set[str]:
+        """Load the installed packages from the cache or the database.
+
+        :returns: the installed packages.
+
+        """
+        import json
+
+        database_stat = self.backend.database_path.stat()
+        cache_file_path = CACHE_PATH / f"{self.backend.name}_packages.json"
+        cache_key = [self.CACHE_VERSION, database_stat.st_mtime_ns, database_stat.st_size]
+
+        with contextlib.suppress(OSError, ValueError):
+            with cache_file_path.open() as f:
+                cache = json.load(f)
+            if cache["key"] == cache_key:
+                return set(cache["packages"])
+
+        packages = self.backend.reader(self.backend.database_path)
+
+        with contextlib.suppress(OSError):
+            CACHE_PATH.mkdir(exist_ok=True)
+            with cache_file_path.open("w") as f:
+                json.dump({"key": cache_key, "packages": sorted(packages)}, f)
+
+        return packages
+
+    def missing(self, file: HomeFile) -> Set[str]:
+        """Obtain the dependencies of the file that are not installed.
+
+        Dependencies are translated with the file aliases of the backend.
+
+        :param file: file whose dependencies are checked.
+        :returns: the backend names of the missing dependencies.
+
+        """
+        aliases = file.package_aliases.get(self.backend.name, {})
+        return {
+            aliases.get(package, package)
+            for package in file.packages
+            if aliases.get(package, package) not in self.packages
+        }
+
+
+package_databases: Dict[str, Optional[PackageDatabase]] = {}
+
+
+def open_package_database(backend_name: str = "auto") -> Optional[PackageDatabase]:
+    """Obtain the package database of the backend, without loading it.
+
+    Databases are opened once per process and kept in
+    :data:`package_databases`.
+
+    :param backend_name: name of the backend, ``auto`` to use the first one
+        whose database exists.
+    :returns: the package database, or None if there is no database.
+
+    """
+    if backend_name not in package_databases:
+        package_databases[backend_name] = next(
+            (
+                PackageDatabase(backend)
+                for backend in PACKAGE_BACKENDS
+                if backend_name in ("auto", backend.name) and backend.database_path.exists()
+            ),
+            None,
+        )
+
+    return package_databases[backend_name]
+
+
+def install_missing_packages(
+    selected_files: List[HomeFile], backend_name: str = "auto", command: Optional[str] = None
+) -> bool:
+    """Install the missing dependencies of every selected file at once.
+
+    The union of the missing packages is installed in a single package
+    manager transaction, and the package database is read again afterwards.
+
+    :param selected_files: list of selected files.
+    :param backend_name: name of the package backend.
+    :param command: command line installing the packages given after it, by
+        default the package manager of the backend, run through ``sudo``
+        unless running as root.
+    :returns: False if the installation failed.
+
+    """
+    import shlex
+    import subprocess
+
+    if not any(file.packages for file in selected_files):
+        return True
+
+    package_database = open_package_database(backend_name)
+    if package_database is None:
+        raise BackstoreError("There is no package database to find the missing packages.")
+
+    with profiler.phase("package query"):
+        missing_packages: Set[str] = set()
+        for file in selected_files:
+            if file.packages:
+                missing_packages |= package_database.missing(file)
+
+    if not missing_packages:
+        return True
+
+    if command:
+        arguments = shlex.split(command)
+    else:
+        arguments = list(package_database.backend.install_command)
+        if os.geteuid() != 0:
+            arguments.insert(0, "sudo")
+    arguments.extend(sorted(missing_packages))
+
+    print_header(f"Installing {len(missing_packages)} missing packages.")
+    renderer.flush()
+
+    # The package manager output is kept out of the machine readable one
+    with profiler.phase("package installation"):
+        try:
+            returncode = subprocess.run(
+                arguments,
+                stdout=sys.stderr if renderer.mode == OutputMode.PORCELAIN else None,
+            ).returncode
+        except OSError as error:
+            print_style(
+                f"Could not run `{arguments[0]}`: {error.strerror}.", colour.fg_red, sys.stderr
+            )
+            return False
+
+    package_databases[backend_name] = PackageDatabase(package_database.backend)
+
+    if returncode != 0:
+        print_style(
+            f"The package installation failed with exit status {returncode}.",
+            colour.fg_red,
+            sys.stderr,
+        )
+        return False
+
+    return True
+
+
+def file_fingerprint(file: HomeFile, mode: InstallMode = InstallMode.SYMLINK) -> Optional[Dict]:
+    """Obtain what identifies an applied file between runs.
+
+    The fingerprint is made of the file definition, its link target, the
+    installation mode and the ``lstat`` information of both the repository
+    file and the ``$HOME`` link.
+
+    :param file: file to fingerprint.
+    :param mode: how the file is installed.
+    :returns: the fingerprint, or None if any side of the link does not exist
+        or the installed directory copy can not be trusted by its ``lstat``.
+
+    """
+    import hashlib
+    import json
+
+    target_path = source_path(file)
+
+    try:
+        repo_stat = os.lstat(target_path)
+        dir_fd, name, entry = directory_cache.acquire(os.path.join(HOME_PATH, file.relpath))
+        try:
+            home_stat = os.lstat(name, dir_fd=dir_fd)
+        finally:
+            directory_cache.release(entry)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+    if mode != InstallMode.SYMLINK and stat.S_ISDIR(repo_stat.st_mode):
+        return None
+
+    definition = json.dumps(
+        [
+            file.description,
+            sorted(file.packages),
+            file.package_aliases,
+            file.template,
+            file.variables,
+        ],
+        sort_keys=True,
+    )
+
+    return {
+        "definition": hashlib.sha1(definition.encode()).hexdigest(),
+        "target": str(target_path),
+        "mode": mode.value,
+        "repo_mtime": repo_stat.st_mtime_ns,
+        "home": [home_stat.st_ino, home_stat.st_mtime_ns],
+    }
+
+
+def is_outdated_copy(fingerprint: Optional[Dict], entry: Optional[Dict]) -> bool:
+    """Check whether an installed copy was not modified since it was applied,
+    so only its repository side changed.
+
+    :param fingerprint: current fingerprint of the file.
+    :param entry: fingerprint recorded when the file was applied.
+    :returns: True if the copy can be replaced without losing local changes.
+
+    """
+    if fingerprint is None or entry is None:
+        return False
+
+    return fingerprint["mode"] != InstallMode.SYMLINK.value and all(
+        fingerprint[key] == entry.get(key) for key in ("target", "mode", "home")
+    )
+
+
+def load_state() -> Dict:
+    """Load the state database of the previous runs.
+
+    :returns: the state database, empty if it does not exist or is invalid.
+
+    """
+    import json
+
+    with contextlib.suppress(OSError, ValueError):
+        with STATE_FILE_PATH.open() as f:
+            state = json.load(f)
+        if isinstance(state.get("entries"), dict):
+            return state
+
+    return {"entries": {}}
+
+
+def save_state(entries: Dict[str, Dict]) -> None:
+    """Write the state database atomically.
+
+    :param entries: fingerprint of each applied file indexed by its relative
+        path.
+
+    """
+    import json
+
+    temporary_path = STATE_FILE_PATH.with_suffix(".tmp")
+
+    with temporary_path.open("w") as f:
+        json.dump({"entries": entries}, f, separators=(",", ":"))
+    os.replace(temporary_path, STATE_FILE_PATH)
+
+
+class Action(Enum):
+    """Planned operation for a selected file."""
+
+    CREATE = "create"
+    SKIP = "skip"
+    REPLACE = "replace"
+    DELETE = "delete"
+    MISSING_DEPENDENCY = "missing-dependency"
+
+
+class PlanAction(NamedTuple):
+    """Planned operation over one selected file.
+
+    :ivar action: operation to perform.
+    :ivar path: home-relative path of the file.
+    :ivar link: full path of the file in the ``$HOME`` directory.
+    :ivar target: full path of the file in the repository.
+    :ivar state: state of the file when the plan was computed.
+    :ivar reason: human readable explanation of the operation.
+    :ivar packages: missing packages of the file.
+    :ivar mode: how the file is installed.
+    :ivar file: selected file the operation was planned for, unknown for
+        plans loaded from a file.
+
+    """
+
+    action: Action
+    path: str
+    link: str
+    target: str
+    state: LinkState
+    reason: str = ""
+    packages: List[str] = []
+    mode: InstallMode = InstallMode.SYMLINK
+    file: Optional[HomeFile] = None
+
+    def to_json(self) -> Dict:
+        """Obtain the JSON representation of the planned operation.
+
+        :returns: the planned operation as a JSON serializable dictionary.
+
+        """
+        record = self._asdict()
+        del record["file"]
+        return {
+            **record,
+            "action": self.action.value,
+            "state": self.state.value,
+            "mode": self.mode.value,
+        }
+
+    @classmethod
+    def from_json(cls, record: Dict) -> "PlanAction":
+        """Build a planned operation from its JSON representation.
+
+        :param record: planned operation as a dictionary.
+        :returns: the planned operation.
+
+        """
+        return cls(
+            **{
+                **record,
+                "action": Action(record["action"]),
+                "state": LinkState(record["state"]),
+                "mode": InstallMode(record.get("mode", InstallMode.SYMLINK.value)),
+            }
+        )
+
+
+class Outcome(Enum):
+    """Final status of a processed file."""
+
+    LINKED = "linked"
+    DELETED = "deleted"
+    RESTORED = "restored"
+    SKIPPED = "skipped"
+    MISSING_DEPENDENCIES = "with missing dependencies"
+    FAILED = "failed"
+
+
+class FileResult(NamedTuple):
+    """Result of processing one selected file.
+
+    :ivar file: processed file.
+    :ivar outcome: final status of the file.
+    :ivar messages: ``(text, style)`` pairs to report for the file.
+    :ivar action: planned operation performed, if the file was processed
+        from a plan.
+
+    """
+
+    file: HomeFile
+    outcome: Outcome
+    messages: List[Tuple[str, str]] = []
+    action: Optional[PlanAction] = None
+
+
+def print_header(text: str) -> None:
+    """Print the heading of an action, only in normal output mode.
+
+    :param text: heading text.
+
+    """
+    if renderer.mode == OutputMode.NORMAL:
+        renderer.write(f"{text}\n")
+
+
+def print_counts(counts: Counter, kinds: Iterable[Enum]) -> None:
+    """Print the summary line of the counted kinds and flush the output.
+
+    In porcelain mode every kind is printed, even if it was not counted.
+
+    :param counts: number of entries of each kind.
+    :param kinds: kinds in the order they are printed.
+
+    """
+    if renderer.mode == OutputMode.PORCELAIN:
+        renderer.write(
+            "\t".join(["summary"] + [f"{kind.name.lower()}={counts[kind]}" for kind in kinds])
+        )
+    else:
+        summary = ", ".join(f"{counts[kind]} {kind.value}" for kind in kinds if counts[kind])
+        if renderer.mode == OutputMode.NORMAL:
+            renderer.write()
+        renderer.write(f"Summary: {summary or 'nothing to do'}.")
+
+    renderer.flush()
+
+
+def print_results(results: Iterable[FileResult]) -> List[FileResult]:
+    """Print the results followed by a summary.
+
+    In quiet and porcelain modes skipped files are only counted.
+
+    :param results: processed files results.
+    :returns: the printed results.
+
+    """
+    outcomes: Counter = Counter()
+    printed_results: List[FileResult] = []
+
+    for result in results:
+        printed_results.append(result)
+        outcomes[result.outcome] += 1
+        if renderer.mode == OutputMode.PORCELAIN:
+            if result.outcome != Outcome.SKIPPED:
+                renderer.write(f"{result.outcome.name.lower()}\t{result.file.relpath}")
+        elif renderer.mode == OutputMode.NORMAL or result.outcome != Outcome.SKIPPED:
+            for text, style in result.messages:
+                renderer.write(text, style)
+
+    print_counts(outcomes, Outcome)
+
+    return printed_results
+
+
+def plan_missing_dependencies(
+    file: HomeFile,
+    missing_packages: Set[str],
+    state: LinkState,
+    mode: InstallMode = InstallMode.SYMLINK,
+) -> PlanAction:
+    """Plan the report of the dependencies of the file that are not installed.
+
+    :param file: file to link.
+    :param missing_packages: dependencies of the file that are not installed.
+    :param state: state of the file in the ``$HOME`` directory.
+    :param mode: how the file is installed.
+    :returns: the planned report.
+
+    """
+    return PlanAction(
+        Action.MISSING_DEPENDENCY,
+        file.relpath,
+        str(HOME_PATH / (file.relpath)),
+        str(source_path(file)),
+        state,
+        reason="Missing some dependencies for the selected file: "
+        f"{' '.join(sorted(missing_packages))}",
+        packages=sorted(missing_packages),
+        mode=mode,
+        file=file,
+    )
+
+
+def plan_link_file(
+    file: HomeFile,
+    file_state: FileState,
+    missing_packages: Set[str],
+    force: bool = False,
+    mode: InstallMode = InstallMode.SYMLINK,
+) -> List[PlanAction]:
+    """Plan the linking of the file.
+
+    When installing copies, links to the repository and outdated copies are
+    replaced without the need of ``force``.
+
+    :param file: file to link.
+    :param file_state: state of the file in the ``$HOME`` directory.
+    :param missing_packages: dependencies of the file that are not installed.
+    :param force: whether to always replace the existing file or not.
+    :param mode: how the file is installed.
+    :returns: the planned operations for the file.
+
+    """
+    link_name_path = HOME_PATH / (file.relpath)
+    target_path = source_path(file)
+    plan_action = functools.partial(
+        PlanAction,
+        path=file.relpath,
+        link=str(link_name_path),
+        target=str(target_path),
+        state=file_state.state,
+        mode=mode,
+        file=file,
+    )
+    linking = mode == InstallMode.SYMLINK
+    actions: List[PlanAction] = []
+
+    if missing_packages:
+        actions.append(plan_missing_dependencies(file, missing_packages, file_state.state, mode))
+
+    if file_state.state == LinkState.LINKED and linking and not force:
+        actions.append(
+            plan_action(Action.SKIP, reason=f"File `{str(link_name_path)}` is already linked.")
+        )
+    elif file_state.state == LinkState.IDENTICAL and not force:
+        actions.append(
+            plan_action(Action.SKIP, reason=f"File `{str(link_name_path)}` is already installed.")
+        )
+    elif file_state.state == LinkState.FOLDED and linking and not force:
+        actions.append(
+            plan_action(
+                Action.SKIP,
+                reason=f"File `{str(link_name_path)}` is already linked through a parent "
+                "directory.",
+            )
+        )
+    elif file_state.state == LinkState.WRONG_LINK and not force:
+        actions.append(
+            plan_action(
+                Action.SKIP,
+                reason=f"File `{str(link_name_path)}` "
+                f"is linked to `{str(file_state.link_target)}` "
+                f"instead of `{str(target_path)}`. Please remove it "
+                "manually or use --force.",
+            )
+        )
+    elif file_state.state == LinkState.REGULAR and linking and not force:
+        actions.append(
+            plan_action(
+                Action.SKIP,
+                reason=f"File `{str(link_name_path)}` exists and it is not a "
+                "symbolic link. Please remove it manually or use --force "
+                "argument.",
+            )
+        )
+    elif file_state.state == LinkState.REGULAR and not force:
+        actions.append(
+            plan_action(
+                Action.SKIP,
+                reason=f"File `{str(link_name_path)}` exists and it differs from "
+                f"`{str(target_path)}`. Please remove it manually or use --force "
+                "argument.",
+            )
+        )
+    elif file_state.state == LinkState.MISSING:
+        actions.append(plan_action(Action.CREATE))
+    else:
+        actions.append(plan_action(Action.REPLACE))
+
+    return actions
+
+
+def plan_delete_file(
+    file: HomeFile,
+    file_state: FileState,
+    force: bool = False,
+    mode: InstallMode = InstallMode.SYMLINK,
+) -> PlanAction:
+    """Plan the deletion of the file link.
+
+    Links to the repository and identical copies are always deleted.
+
+    :param file: file to unlink.
+    :param file_state: state of the file in the ``$HOME`` directory.
+    :param force: whether to always delete the existing file or not.
+    :param mode: how the file was installed.
+    :returns: the planned operation for the file.
+
+    """
+    link_name_path = HOME_PATH / (file.relpath)
+    target_path = source_path(file)
+    plan_action = functools.partial(
+        PlanAction,
+        path=file.relpath,
+        link=str(link_name_path),
+        target=str(target_path),
+        state=file_state.state,
+        mode=mode,
+        file=file,
+    )
+
+    if file_state.state == LinkState.MISSING:
+        return plan_action(Action.SKIP, reason=f"File `{str(link_name_path)}` does not exist.")
+    elif file_state.state == LinkState.WRONG_LINK and not force:
+        return plan_action(
+            Action.SKIP,
+            reason=f"File `{str(link_name_path)}` "
+            f"is linked to `{str(file_state.link_target)}` "
+            f"instead of `{str(target_path)}`. Please remove it "
+            "manually or use --force argument.",
+        )
+    elif file_state.state == LinkState.REGULAR and not force:
+        return plan_action(
+            Action.SKIP,
+            reason=f"File `{str(link_name_path)}` exists and it is not a "
+            "symbolic link nor an identical copy. Use --force to delete it.",
+        )
+
+    return plan_action(Action.DELETE)
+
+
+def plan_link(
+    selected_files: List[HomeFile],
+    force: bool = False,
+    jobs: int = 1,
+    incremental: bool = True,
+    fold: bool = False,
+    mode: InstallMode = InstallMode.SYMLINK,
+    package_backend: str = "auto",
+    check_dependencies: bool = True,
+    fingerprints: Optional[Dict[str, Dict]] = None,
+) -> Tuple[List[HomeFile], List[PlanAction]]:
+    """Plan the linking of the selected files without modifying the ``$HOME``
+    directory.
+
+    Templates of generated files are rendered first when their inputs changed.
+
+    Files applied in a previous run whose definition, repository file and
+    ``$HOME`` link did not change since then are not examined again, unless
+    ``incremental`` is disabled or ``force`` is used. Installed copies that
+    differ from the repository file but were not modified since they were
+    applied are outdated, so they are replaced instead of backed up.
+
+    :param selected_files: list of selected files.
+    :param force: whether to always replace the existing files or not.
+    :param jobs: number of files inspected at the same time.
+    :param incremental: whether to use the state database or not.
+    :param fold: whether to link fully managed directories as a whole or not,
+        only used when installing symbolic links.
+    :param mode: how the files are installed.
+    :param package_backend: name of the package backend checking the
+        dependencies.
+    :param check_dependencies: whether to plan the report of the missing
+        dependencies or not. The package database is loaded in the background
+        while the files are inspected either way.
+    :param fingerprints: if given, filled with the fingerprint of the files
+        found unchanged, indexed by their relative path.
+    :returns: the planned files, after folding them, and their operations.
+
+    """
+    with profiler.phase("template rendering"):
+        render_templates(selected_files, jobs)
+
+    if fold and mode == InstallMode.SYMLINK:
+        selected_files = fold_files(selected_files)
+
+    package_database = None
+    if any(file.packages for file in selected_files):
+        package_database = open_package_database(package_backend)
+        if package_database is None:
+            print_style(
+                f"Skipping dependencies check: no `{package_backend}` package database found.\n",
+                colour.fg_yellow,
+                file=sys.stderr,
+            )
+        else:
+            package_database.prefetch()
+
+    unchanged_files: Set[str] = set()
+    state_entries: Dict[str, Dict] = {}
+    current_fingerprints: Dict[str, Optional[Dict]] = {}
+    if incremental and (not force or mode != InstallMode.SYMLINK):
+        fingerprint_file = profiler.timed(
+            functools.partial(file_fingerprint, mode=mode), lambda file: file.relpath
+        )
+        with profiler.phase("state resolution"):
+            state_entries = load_state()["entries"]
+            for file, fingerprint in zip(
+                selected_files, map_files(fingerprint_file, selected_files, jobs)
+            ):
+                current_fingerprints[file.relpath] = fingerprint
+                if (
+                    not force
+                    and fingerprint is not None
+                    and fingerprint == state_entries.get(file.relpath)
+                ):
+                    unchanged_files.add(file.relpath)
+                    if fingerprints is not None:
+                        fingerprints[file.relpath] = fingerprint
+
+    states = snapshot_files(
+        [file for file in selected_files if file.relpath not in unchanged_files], jobs, mode
+    )
+    for relpath, file_state in states.items():
+        if file_state.state == LinkState.REGULAR and is_outdated_copy(
+            current_fingerprints.get(relpath), state_entries.get(relpath)
+        ):
+            states[relpath] = FileState(LinkState.OUTDATED)
+    unchanged_state = FileState(
+        LinkState.LINKED if mode == InstallMode.SYMLINK else LinkState.IDENTICAL
+    )
+    actions: List[PlanAction] = []
+
+    for file in selected_files:
+        missing_packages: Set[str] = set()
+        if check_dependencies and package_database is not None and file.packages:
+            with profiler.phase("package query"):
+                missing_packages = package_database.missing(file)
+        file_state = states.get(file.relpath, unchanged_state)
+        actions.extend(plan_link_file(file, file_state, missing_packages, force, mode))
+
+    return selected_files, actions
+
+
+def plan_delete(
+    selected_files: List[HomeFile],
+    force: bool = False,
+    jobs: int = 1,
+    fold: bool = False,
+    mode: InstallMode = InstallMode.SYMLINK,
+) -> Tuple[List[HomeFile], Dict[str, FileState], List[PlanAction]]:
+    """Plan the deletion of the selected files links without modifying anything.
+
+    :param selected_files: list of selected files.
+    :param force: whether to always delete the existing files or not.
+    :param jobs: number of files inspected at the same time.
+    :param fold: whether to delete fully managed folded directories as a
+        whole or not, only used for symbolic links.
+    :param mode: how the files were installed.
+    :returns: the planned files, after folding them, their states and their
+        operations.
+
+    """
+    if fold and mode == InstallMode.SYMLINK:
+        selected_files = fold_files(selected_files, deleting=True)
+
+    states = snapshot_files(selected_files, jobs, mode)
+    actions = [
+        plan_delete_file(file, states[file.relpath], force, mode) for file in selected_files
+    ]
+
+    return selected_files, states, actions
+
+
+def print_plan(actions: Iterable[PlanAction], output_format: str = "ndjson") -> None:
+    """Print the planned operations as JSON.
+
+    :param actions: planned operations.
+    :param output_format: ``json`` for a single array or ``ndjson`` for one
+        operation per line.
+
+    """
+    import json
+
+    if output_format == "json":
+        renderer.write(json.dumps([action.to_json() for action in actions], indent=2))
+    else:
+        for action in actions:
+            renderer.write(json.dumps(action.to_json()))
+
+    renderer.flush()
+
+
+def load_plan(plan_path: str) -> List[PlanAction]:
+    """Load the planned operations from a JSON or NDJSON file.
+
+    :param plan_path: path of the plan file, ``-`` to read the standard input.
+    :returns: the planned operations.
+    :raises BackstoreError: if the plan can not be read or decoded.
+
+    """
+    import json
+
+    try:
+        if plan_path == "-":
+            content = sys.stdin.read()
+        else:
+            content = Path(plan_path).read_text()
+    except OSError as error:
+        raise BackstoreError(f"Could not read the plan: {error}.")
+
+    try:
+        if content.lstrip().startswith("["):
+            records = json.loads(content)
+        else:
+            records = [json.loads(line) for line in content.splitlines() if line.strip()]
+        return [PlanAction.from_json(record) for record in records]
+    except (ValueError, TypeError, KeyError) as error:
+        raise BackstoreError(f"Problem decoding the plan `{plan_path}`: {error}.")
+
+
+def action_file(action: PlanAction) -> HomeFile:
+    """Obtain the file of the planned operation.
+
+    Plans loaded from a file do not keep the selected files, so a file with
+    the same path and source is built for them.
+
+    :param action: planned operation.
+    :returns: the file the operation was planned for.
+
+    """
+    if action.file is not None:
+        return action.file
+
+    # Only whether the file is rendered matters to inspect its state
+    rendered = action.target == str(BUILD_PATH / (action.path))
+    return HomeFile(action.path, template=action.path if rendered else "")
+
+
+def apply_action(
+    action: PlanAction, verify: bool = True, state_entries: Optional[Dict[str, Dict]] = None
+) -> FileResult:
+    """Perform the planned operation.
+
+    :param action: planned operation.
+    :param verify: whether to check that the file did not change since the
+        plan was computed or not.
+    :param state_entries: fingerprints of the applied files, to verify that
+        outdated copies were not modified.
+    :returns: the result of the operation.
+
+    """
+    file = action_file(action)
+    key = apply_style(action.path, colour.bold)
+
+    if action.action == Action.MISSING_DEPENDENCY:
+        return FileResult(
+            file,
+            Outcome.MISSING_DEPENDENCIES,
+            [(f"{key}: {action.reason}", colour.fg_yellow)],
+            action,
+        )
+    elif action.action == Action.SKIP:
+        if action.state in (LinkState.LINKED, LinkState.FOLDED, LinkState.IDENTICAL):
+            style = colour.fg_green
+        elif action.state == LinkState.MISSING:
+            style = colour.fg_yellow
+        else:
+            style = colour.fg_red
+        return FileResult(file, Outcome.SKIPPED, [(f"{key}: {action.reason}", style)], action)
+
+    link_name_path = HOME_PATH / (action.path)
+    target_path = Path(action.target)
+
+    if verify:
+        expected_states = {action.state}
+        if action.state == LinkState.FOLDED:
+            expected_states.add(LinkState.LINKED)
+        if (action.link, target_path) != (str(link_name_path), source_path(file)):
+            return FileResult(
+                file,
+                Outcome.FAILED,
+                [(f"{key}: The plan was computed for other directories.", colour.fg_red)],
+                action,
+            )
+        file_state = read_file_state(file, action.mode)
+        if (
+            file_state.state == LinkState.REGULAR
+            and action.state == LinkState.OUTDATED
+            and is_outdated_copy(
+                file_fingerprint(file, action.mode), (state_entries or {}).get(action.path)
+            )
+        ):
+            file_state = FileState(LinkState.OUTDATED)
+        if file_state.state not in expected_states:
+            return FileResult(
+                file,
+                Outcome.FAILED,
+                [(f"{key}: File changed since the plan was computed.", colour.fg_red)],
+                action,
+            )
+
+    messages: List[Tuple[str, str]] = []
+
+    if action.action in (Action.REPLACE, Action.DELETE):
+        if action.state in (LinkState.REGULAR, LinkState.WRONG_LINK):
+            backup = backup_path(action.path)
+            if backup is not None:
+                messages.append((f"{key}: Previous file backed up ({backup}).", colour.fg_cyan))
+        elif action.state == LinkState.IDENTICAL and link_name_path.is_dir():
+            import shutil
+
+            directory_cache.invalidate(link_name_path)
+            shutil.rmtree(link_name_path)
+        else:
+            with contextlib.suppress(FileNotFoundError):
+                dir_fd, name, entry = directory_cache.acquire(str(link_name_path))
+                try:
+                    os.unlink(name, dir_fd=dir_fd)
+                finally:
+                    directory_cache.release(entry)
+
+    if action.action == Action.DELETE:
+        messages.insert(
+            0, (f"{key}: File `{str(link_name_path)}` deleted correctly.", colour.fg_green)
+        )
+        return FileResult(file, Outcome.DELETED, messages, action)
+
+    try:
+        install_path(target_path, link_name_path, action.mode)
+    except FileNotFoundError:
+        # Parent directories are only created when missing
+        link_name_path.parent.mkdir(parents=True, exist_ok=True)
+        install_path(target_path, link_name_path, action.mode)
+
+    if action.mode == InstallMode.SYMLINK:
+        message = f"{key}: File `{str(link_name_path)}` linked correctly."
+    else:
+        message = f"{key}: File `{str(link_name_path)}` installed correctly ({action.mode.value})."
+
+    return FileResult(file, Outcome.LINKED, [(message, colour.fg_green)] + messages, action)
+
+
+def apply_plan(
+    actions: List[PlanAction], jobs: int = 1, verify: bool = True
+) -> Iterator[FileResult]:
+    """Perform the planned operations.
+
+    Files reached through a folded parent directory are unfolded one by one
+    before anything else, since they may share parents, so the repository
+    files are never removed.
+
+    :param actions: planned operations.
+    :param jobs: maximum number of operations performed at the same time.
+    :param verify: whether to check that the files did not change since the
+        plan was computed or not.
+    :returns: an iterator over the results of each operation, in plan order.
+
+    """
+
+    def safe_apply_action(action: PlanAction) -> FileResult:
+        """Perform the operation turning filesystem errors into failed results.
+
+        :param action: planned operation.
+        :returns: the result of the operation or a failed result.
+
+        """
+        try:
+            return apply_action(action, verify, state_entries)
+        except OSError as error:
+            key = apply_style(action.path, colour.bold)
+            return FileResult(
+                action_file(action), Outcome.FAILED, [(f"{key}: {error}", colour.fg_red)], action
+            )
+
+    state_entries: Dict[str, Dict] = {}
+    if verify and any(action.state == LinkState.OUTDATED for action in actions):
+        state_entries = load_state()["entries"]
+
+    with profiler.phase("filesystem mutation"):
+        for action in actions:
+            if action.state == LinkState.FOLDED and action.action in (
+                Action.REPLACE,
+                Action.DELETE,
+            ):
+                unfold_parents(action.path)
+
+        try:
+            yield from map_files(
+                profiler.timed(safe_apply_action, lambda action: action.path), actions, jobs
+            )
+        finally:
+            # Directories may change before the next plan is applied
+            directory_cache.clear()
+
+
+def link_selected_files(
+    selected_files: List[HomeFile],
+    force: bool = False,
+    install: bool = False,
+    jobs: int = 1,
+    incremental: bool = True,
+    fold: bool = False,
+    mode: InstallMode = InstallMode.SYMLINK,
+    package_backend: str = "auto",
+    install_command: Optional[str] = None,
+) -> None:
+    """Link selected files.
+
+    :param selected_files: list of selected files.
+    :param force: whether to always delete the link or not.
+    :param install: whether to install the missing dependencies of the files
+        or not.
+    :param jobs: number of files linked at the same time.
+    :param incremental: whether to use the state database or not.
+    :param fold: whether to link fully managed directories as a whole or not.
+    :param mode: how the files are installed.
+    :param package_backend: name of the package backend checking the
+        dependencies.
+    :param install_command: command line installing the packages given after
+        it, instead of the package manager of the backend.
+    :raises BackstoreError: if the dependencies could not be installed.
+
+    """
+    files_by_relpath = {file.relpath: file for file in selected_files}
+    # Files found unchanged are not fingerprinted again after linking
+    unchanged_fingerprints: Dict[str, Dict] = {}
+    planned_files, actions = plan_link(
+        selected_files,
+        force,
+        jobs,
+        incremental,
+        fold,
+        mode,
+        package_backend,
+        False,
+        unchanged_fingerprints,
+    )
+    files_by_relpath.update((file.relpath, file) for file in planned_files)
+    installed = True
+
+    def perform_actions() -> Iterator[FileResult]:
+        """Perform the operations and then report the missing dependencies,
+        so the package database is only waited for once linking is done.
+
+        :returns: an iterator over the results of each operation.
+
+        """
+        nonlocal installed
+
+        yield from apply_plan(actions, jobs, verify=False)
+
+        if install:
+            installed = install_missing_packages(
+                [files_by_relpath[action.path] for action in actions],
+                package_backend,
+                install_command,
+            )
+
+        package_database = open_package_database(package_backend)
+        if package_database is None:
+            return
+
+        dependency_actions: List[PlanAction] = []
+        with profiler.phase("package query"):
+            for action in actions:
+                file = files_by_relpath[action.path]
+                missing_packages = package_database.missing(file) if file.packages else set()
+                if missing_packages:
+                    dependency_actions.append(
+                        plan_missing_dependencies(file, missing_packages, action.state, mode)
+                    )
+        yield from apply_plan(dependency_actions, jobs, verify=False)
+
+    results = print_results(perform_actions())
+
+    state_entries: Dict[str, Dict] = load_state()["entries"]
+    applied_files: List[HomeFile] = []
+    changed = False
+
+    for action, result in zip(actions, results):
+        if action.path in unchanged_fingerprints:
+            continue
+        elif result.outcome == Outcome.LINKED or (
+            action.action == Action.SKIP
+            and action.state in (LinkState.LINKED, LinkState.FOLDED, LinkState.IDENTICAL)
+        ):
+            applied_files.append(files_by_relpath[action.path])
+        elif state_entries.pop(action.path, None) is not None:
+            changed = True
+
+    for file, fingerprint in zip(
+        applied_files,
+        map_files(functools.partial(file_fingerprint, mode=mode), applied_files, jobs),
+    ):
+        if fingerprint is None:
+            changed |= state_entries.pop(file.relpath, None) is not None
+        elif state_entries.get(file.relpath) != fingerprint:
+            state_entries[file.relpath] = fingerprint
+            changed = True
+
+    if changed:
+        save_state(state_entries)
+
+    if not installed:
+        raise BackstoreError("Could not install the missing dependencies.")
+
+
+def ask_confirmation(question: str) -> bool:
+    """Ask a yes or no question.
+
+    In quiet and porcelain modes the question is asked in the standard error.
+
+    :param question: question to ask.
+    :returns: whether the answer was ``yes`` or not.
+
+    """
+    prompt = f"{question} (yes/no): "
+
+    if renderer.mode == OutputMode.NORMAL:
+        answer = input(f"\n{prompt}")
+    else:
+        print(prompt, end="", file=sys.stderr, flush=True)
+        answer = input()
+
+    return answer.strip().lower() == "yes"
+
+
+def delete_selected_links(
+    selected_files: List[HomeFile],
+    force: bool = False,
+    jobs: int = 1,
+    fold: bool = False,
+    mode: InstallMode = InstallMode.SYMLINK,
+    confirm: bool = True,
+) -> None:
+    """Delete selected files.
+
+    :param selected_files: list of selected files.
+    :param force: whether to always delete the link or not.
+    :param jobs: number of links deleted at the same time.
+    :param fold: whether to delete fully managed folded directories as a
+        whole or not.
+    :param mode: how the files were installed.
+    :param confirm: whether to ask for confirmation before deleting or not.
+
+    """
+    planned_files, states, actions = plan_delete(selected_files, force, jobs, fold, mode)
+
+    if renderer.mode == OutputMode.NORMAL:
+        print_selected_files(planned_files, states)
+    else:
+        for action in actions:
+            if action.action == Action.DELETE:
+                renderer.write(f"delete\t{action.path}")
+        renderer.flush()
+
+    if confirm and not ask_confirmation("Are you sure you want to delete previous links?"):
+        if renderer.mode == OutputMode.NORMAL:
+            renderer.write("\nAborting symlinks deletion.")
+        renderer.flush()
+        return
+
+    results = print_results(apply_plan(actions, jobs, verify=False))
+
+    state_entries: Dict[str, Dict] = load_state()["entries"]
+    deleted_entries = [
+        state_entries.pop(result.file.relpath, None)
+        for result in results
+        if result.outcome == Outcome.DELETED
+    ]
+    if any(entry is not None for entry in deleted_entries):
+        save_state(state_entries)
+
+
+def restore_file(
+    file: HomeFile,
+    record: Optional[Dict],
+    force: bool = False,
+    mode: InstallMode = InstallMode.SYMLINK,
+) -> FileResult:
+    """Restore the backup of the file in the ``$HOME`` directory.
+
+    Links and copies of the repository file are replaced by the backup. Any
+    other file is only replaced using ``force``, after backing it up too.
+
+    :param file: file to restore.
+    :param record: latest backup record of the file, if any.
+    :param force: whether to replace files not installed from the repository.
+    :param mode: how the files were installed.
+    :returns: the result of the restoration.
+
+    """
+    key = apply_style(file.relpath, colour.bold)
+    link_name_path = HOME_PATH / file.relpath
+
+    if record is None:
+        return FileResult(
+            file, Outcome.SKIPPED, [(f"{key}: There is no backup of the file.", colour.fg_yellow)]
+        )
+
+    file_state = read_file_state(file, mode)
+
+    if file_state.state in (LinkState.REGULAR, LinkState.WRONG_LINK):
+        if not force:
+            return FileResult(
+                file,
+                Outcome.SKIPPED,
+                [
+                    (
+                        f"{key}: File `{str(link_name_path)}` is not installed from the "
+                        "repository. Use --force to replace it.",
+                        colour.fg_red,
+                    )
+                ],
+            )
+        backup_path(file.relpath)
+    elif file_state.state == LinkState.FOLDED:
+        unfold_parents(file.relpath)
+        link_name_path.unlink()
+    elif file_state.state == LinkState.IDENTICAL and link_name_path.is_dir():
+        import shutil
+
+        directory_cache.invalidate(link_name_path)
+        shutil.rmtree(link_name_path)
+    elif file_state.state != LinkState.MISSING:
+        link_name_path.unlink()
+
+    link_name_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if "target" in record:
+        os.symlink(record["target"], link_name_path)
+    else:
+        object_path = BACKUP_PATH / "objects" / record["object"][:2] / record["object"][2:]
+        copy_file(object_path, link_name_path, reflink=True)
+        os.chmod(link_name_path, record["mode"])
+
+    return FileResult(
+        file,
+        Outcome.RESTORED,
+        [(f"{key}: File `{str(link_name_path)}` restored correctly.", colour.fg_green)],
+    )
+
+
+def restore_selected_files(
+    selected_files: List[HomeFile],
+    force: bool = False,
+    jobs: int = 1,
+    mode: InstallMode = InstallMode.SYMLINK,
+) -> None:
+    """Restore the latest backup of the selected files.
+
+    :param selected_files: list of selected files.
+    :param force: whether to replace files not installed from the repository.
+    :param jobs: number of files restored at the same time.
+    :param mode: how the files were installed.
+
+    """
+    backups = load_backups()
+
+    def safe_restore_file(file: HomeFile) -> FileResult:
+        """Restore the file turning filesystem errors into failed results.
+
+        :param file: file to restore.
+        :returns: the result of the restoration or a failed result.
+
+        """
+        try:
+            return restore_file(file, backups.get(file.relpath), force, mode)
+        except OSError as error:
+            key = apply_style(file.relpath, colour.bold)
+            return FileResult(file, Outcome.FAILED, [(f"{key}: {error}", colour.fg_red)])
+
+    results = print_results(map_files(safe_restore_file, selected_files, jobs))
+
+    state_entries: Dict[str, Dict] = load_state()["entries"]
+    restored_entries = [
+        state_entries.pop(result.file.relpath, None)
+        for result in results
+        if result.outcome == Outcome.RESTORED
+    ]
+    if any(entry is not None for entry in restored_entries):
+        save_state(state_entries)
+
+
+class ManifestTrie(object):
+    """Prefix tree over the home-relative paths of the manifest.
+
+    Each node maps a path component to its child node. Nodes of paths defined
+    in the manifest also hold the full path, so selecting a subtree only
+    visits the matching nodes instead of every manifest key.
+
+    :ivar children: child nodes indexed by path component.
+    :ivar key: full path of the node if it is defined in the manifest.
+
+    """
+
+    GLOB_CHARACTERS: str = "*?["
+
+    def __init__(self, keys: Iterable[str] = ()):
+        """Manifest trie constructor.
+
+        :param keys: home-relative paths to insert.
+
+        """
+        self.children: Dict[str, "ManifestTrie"] = {}
+        self.key: Optional[str] = None
+
+        for key in keys:
+            self.insert(key)
+
+    def insert(self, key: str) -> None:
+        """Insert a home-relative path in the tree.
+
+        :param key: home-relative path.
+
+        """
+        node = self
+        for part in Path(key).parts:
+            node = node.children.setdefault(part, ManifestTrie())
+        node.key = key
+
+    def keys(self) -> Iterator[str]:
+        """Obtain every path defined below this node, including itself.
+
+        :returns: an iterator over the paths of the subtree.
+
+        """
+        if self.key is not None:
+            yield self.key
+        for child in self.children.values():
+            yield from child.keys()
+
+    def covers(self, path: str) -> bool:
+        """Check whether the path is managed by the manifest.
+
+        A path is managed if it is defined in the manifest, if it is below a
+        defined directory or if it is a directory containing defined paths.
+
+        :param path: home-relative path.
+        :returns: True if the path is managed.
+
+        """
+        node = self
+        for part in Path(path).parts:
+            if node.key is not None:
+                return True
+            if part not in node.children:
+                return False
+            node = node.children[part]
+        return True
+
+    def match(self, pattern: str) -> Set[str]:
+        """Obtain the paths selected by the pattern.
+
+        The pattern may be an exact path, a directory prefix (every path below
+        it is selected) or a glob where ``*``, ``?`` and ``[]`` match inside a
+        path component and ``**`` matches any number of components.
+
+        :param pattern: selection pattern.
+        :returns: the selected paths.
+
+        """
+        import fnmatch
+
+        parts = Path(pattern).parts
+        matches: Set[str] = set()
+
+        def walk(node: "ManifestTrie", index: int) -> None:
+            """Collect the paths matching the pattern from the index onwards.
+
+            :param node: current node.
+            :param index: index of the pattern component to match.
+
+            """
+            if index == len(parts):
+                if node.key is not None:
+                    matches.add(node.key)
+                elif not any(c in pattern for c in self.GLOB_CHARACTERS):
+                    matches.update(node.keys())
+                return
+
+            part = parts[index]
+            if part == "**":
+                walk(node, index + 1)
+                for child in node.children.values():
+                    walk(child, index)
+            elif any(c in part for c in self.GLOB_CHARACTERS):
+                for name, child in node.children.items():
+                    if fnmatch.fnmatchcase(name, part):
+                        walk(child, index + 1)
+            elif part in node.children:
+                walk(node.children[part], index + 1)
+
+        walk(self, 0)
+
+        return matches
+
+
+def scan_links(root: Path, jobs: int = 1) -> Tuple[int, List[Tuple[str, str]]]:
+    """Find every symbolic link below the directory.
+
+    Directories are scanned with :func:`os.scandir` by a thread pool, without
+    following directory links and pruning :data:`AUDIT_PRUNED_NAMES` and the
+    repository itself.
+
+    :param root: directory to scan.
+    :param jobs: maximum number of directories scanned at the same time.
+    :returns: the number of scanned directories and the path and raw target of
+        each link found.
+
+    """
+    repo_path = str(AUTOMATION_PATH.parent)
+
+    def scan_directories(path: str) -> Tuple[int, List[str], List[Tuple[str, str]]]:
+        """Scan a batch of directories depth-first starting from the path.
+
+        Batching keeps the cost of scheduling each directory in the pool
+        negligible compared with scanning it.
+
+        :param path: first directory to scan.
+        :returns: the number of scanned directories, the directories left to
+            scan and the links found.
+
+        """
+        pending_directories = [path]
+        links: List[Tuple[str, str]] = []
+        scanned_directories = 0
+
+        while pending_directories and scanned_directories < AUDIT_BATCH_SIZE:
+            scanned_directories += 1
+            with contextlib.suppress(OSError), os.scandir(pending_directories.pop()) as entries:
+                for entry in entries:
+                    if entry.is_symlink():
+                        with contextlib.suppress(OSError):
+                            links.append((entry.path, os.readlink(entry.path)))
+                    elif (
+                        entry.is_dir(follow_symlinks=False)
+                        and entry.name not in AUDIT_PRUNED_NAMES
+                        and entry.path != repo_path
+                    ):
+                        pending_directories.append(entry.path)
+
+        return scanned_directories, pending_directories, links
+
+    scanned_directories = 0
+    found_links: List[Tuple[str, str]] = []
+
+    if jobs <= 1:
+        pending_directories = [str(root)]
+        while pending_directories:
+            scanned, left_directories, links = scan_directories(pending_directories.pop())
+            scanned_directories += scanned
+            found_links.extend(links)
+            pending_directories.extend(left_directories)
+        return scanned_directories, found_links
+
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = {executor.submit(scan_directories, str(root))}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                scanned, left_directories, links = future.result()
+                scanned_directories += scanned
+                found_links.extend(links)
+                pending.update(
+                    executor.submit(scan_directories, path) for path in left_directories
+                )
+
+    return scanned_directories, found_links
+
+
+def audit_links(jobs: int = 1) -> None:
+    """Print the links of the ``$HOME`` directory to the repository that are
+    dangling or not managed by the manifest anymore.
+
+    :param jobs: maximum number of directories scanned at the same time.
+
+    """
+    start_time = time.perf_counter()
+    trie = ManifestTrie(load_manifest_definitions())
+    scanned_directories, links = scan_links(HOME_PATH, jobs)
+    repo_prefix = f"{str(REPO_HOME_PATH)}{os.sep}"
+    dangling_links: List[Tuple[str, str]] = []
+    orphaned_links: List[Tuple[str, str]] = []
+
+    for link_path, raw_target in sorted(links):
+        target = os.path.normpath(os.path.join(os.path.dirname(link_path), raw_target))
+        if not target.startswith(repo_prefix):
+            continue
+
+        if not os.path.exists(target):
+            dangling_links.append((link_path, target))
+        elif not trie.covers(target[len(repo_prefix) :]):
+            orphaned_links.append((link_path, target))
+
+    if renderer.mode == OutputMode.PORCELAIN:
+        for kind, kind_links in (("dangling", dangling_links), ("orphaned", orphaned_links)):
+            for link_path, target in kind_links:
+                renderer.write(f"{kind}\t{link_path}\t{target}")
+        renderer.write(
+            f"summary\tdangling={len(dangling_links)}\torphaned={len(orphaned_links)}"
+            f"\tlinks={len(links)}\tdirectories={scanned_directories}"
+        )
+        renderer.flush()
+        return
+
+    for title, kind_links, style in (
+        ("Dangling links (their repository file does not exist):", dangling_links, colour.fg_red),
+        (
+            f"Orphaned links (their repository file is not in `{ALL_FILES_PATH.name}`):",
+            orphaned_links,
+            colour.fg_yellow,
+        ),
+    ):
+        if not kind_links:
+            continue
+        if renderer.mode == OutputMode.NORMAL:
+            renderer.write(f"{title}\n")
+        for link_path, target in kind_links:
+            renderer.write(f"{link_path} -> {target}", style)
+        if renderer.mode == OutputMode.NORMAL:
+            renderer.write()
+
+    renderer.write(
+        f"Summary: {len(dangling_links)} dangling, {len(orphaned_links)} orphaned, "
+        f"{len(links)} links in {scanned_directories} directories scanned in "
+        f"{time.perf_counter() - start_time:.2f}s."
+    )
+    renderer.flush()
+
+
+def load_manifest_definitions() -> Dict[str, Dict]:
+    """Load the file definitions from :data:`ALL_FILES_PATH`.
+
+    The decoded definitions are compiled into a :mod:`marshal` file in
+    :data:`CACHE_PATH` and reused while the modification time and size of the
+    manifest do not change.
+
+    :returns: the definition of each file indexed by its relative path.
+
+    """
+    manifest_stat = ALL_FILES_PATH.stat()
+    cache_file_path = CACHE_PATH / "manifest.marshal"
+    cache_key = (manifest_stat.st_mtime_ns, manifest_stat.st_size)
+
+    with contextlib.suppress(OSError, ValueError, EOFError, TypeError):
+        with cache_file_path.open("rb") as f:
+            key, definitions = marshal.load(f)
+        if key == cache_key:
+            return definitions
+
+    import json
+
+    with ALL_FILES_PATH.open() as f:
+        try:
+            definitions = json.load(f)
+        except json.JSONDecodeError:
+            raise BackstoreError(f"Problem decoding `{str(ALL_FILES_PATH)}` file")
+
+    with contextlib.suppress(OSError, ValueError):
+        CACHE_PATH.mkdir(exist_ok=True)
+        temporary_path = cache_file_path.with_suffix(".tmp")
+        with temporary_path.open("wb") as f:
+            marshal.dump((cache_key, definitions), f)
+        os.replace(temporary_path, cache_file_path)
+
+    return definitions
+
+
+def check_definition(definition: object) -> List[str]:
+    """Validate the fields of a file definition.
+
+    :param definition: decoded definition of a manifest entry.
+    :returns: the problems found, if any.
+
+    """
+
+    def is_string_list(value: object) -> bool:
+        return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+    def is_string_dict(value: object) -> bool:
+        return isinstance(value, dict) and all(isinstance(item, str) for item in value.values())
+
+    if not isinstance(definition, dict):
+        return ["The definition is not an object."]
+
+    problems = [
+        f"Unknown field `{field}`." for field in definition if field not in HomeFile._fields[1:]
+    ]
+
+    if not isinstance(definition.get("description", ""), str):
+        problems.append("`description` is not a string.")
+
+    packages = definition.get("packages", [])
+    if not is_string_list(packages):
+        problems.append("`packages` is not a list of package names.")
+    elif len(set(packages)) != len(packages):
+        problems.append("`packages` has repeated package names.")
+
+    package_aliases = definition.get("package_aliases", {})
+    if not isinstance(package_aliases, dict) or not all(
+        is_string_dict(aliases) for aliases in package_aliases.values()
+    ):
+        problems.append("`package_aliases` is not an object of package names by backend.")
+    elif not set(package_aliases) <= {backend.name for backend in PACKAGE_BACKENDS}:
+        problems.append("`package_aliases` has unknown package backends.")
+    elif is_string_list(packages) and not all(
+        set(aliases) <= set(packages) for aliases in package_aliases.values()
+    ):
+        problems.append("`package_aliases` has aliases of packages not in `packages`.")
+
+    if not isinstance(definition.get("template", ""), str):
+        problems.append("`template` is not a path.")
+    if not is_string_dict(definition.get("variables", {})):
+        problems.append("`variables` is not an object of strings.")
+
+    return problems
+
+
+def check_manifest() -> int:
+    """Validate :data:`ALL_FILES_PATH` before running any action.
+
+    The raw manifest is decoded keeping repeated keys, which are reported with
+    keys that only differ by ``./``, repeated or trailing slashes. Keys are
+    then visited once, sorted by path components, so a key listed below
+    another one always follows it while its ancestors are in the stack.
+
+    :returns: the number of problems found.
+    :raises BackstoreError: if the manifest can not be read or decoded.
+
+    """
+    import json
+
+    problems: List[Tuple[str, str]] = []
+    decoded_pairs: List[List[Tuple[str, object]]] = []
+
+    def keep_pairs(pairs: List[Tuple[str, object]]) -> Dict:
+        """Keep the pairs of the last decoded object, the outermost one."""
+        decoded_pairs[:] = [pairs]
+        return dict(pairs)
+
+    try:
+        with ALL_FILES_PATH.open() as f:
+            manifest = json.load(f, object_pairs_hook=keep_pairs)
+    except (OSError, json.JSONDecodeError) as error:
+        raise BackstoreError(f"Problem decoding `{str(ALL_FILES_PATH)}` file: {error}")
+
+    if not isinstance(manifest, dict):
+        raise BackstoreError(f"`{str(ALL_FILES_PATH)}` is not an object of file definitions.")
+
+    pairs = decoded_pairs[0]
+
+    normalized_keys: Dict[str, str] = {}
+
+    for key, definition in pairs:
+        normalized_key = os.path.normpath(key)
+        if normalized_key in normalized_keys:
+            original_key = normalized_keys[normalized_key]
+            if original_key == key:
+                problems.append((key, "The key is repeated."))
+            else:
+                problems.append((key, f"The key is the same path as `{original_key}`."))
+            continue
+        normalized_keys[normalized_key] = key
+
+        if normalized_key != key:
+            problems.append((key, f"The key is not normalized, use `{normalized_key}`."))
+        if os.path.isabs(normalized_key) or normalized_key.split(os.sep)[0] in (".", ".."):
+            problems.append((key, "The key is outside of the home directory."))
+            continue
+
+        definition_problems = check_definition(definition)
+        problems.extend((key, problem) for problem in definition_problems)
+        if definition_problems:
+            continue
+
+        repo_path = REPO_HOME_PATH / definition.get("template", normalized_key)
+        if not os.path.lexists(repo_path):
+            problems.append((key, f"The repository file `{str(repo_path)}` does not exist."))
+
+    ancestors: List[str] = []
+
+    for normalized_key in sorted(normalized_keys, key=lambda key: key.split(os.sep)):
+        while ancestors and not normalized_key.startswith(f"{ancestors[-1]}{os.sep}"):
+            ancestors.pop()
+        if ancestors:
+            problems.append(
+                (normalized_keys[normalized_key], f"The key is inside `{ancestors[-1]}`.")
+            )
+        ancestors.append(normalized_key)
+
+    for key, problem in sorted(problems):
+        if renderer.mode == OutputMode.PORCELAIN:
+            renderer.write(f"problem\t{key}\t{problem}")
+        else:
+            renderer.write(f"{apply_style(key, colour.bold)}: {problem}", colour.fg_red)
+
+    if renderer.mode == OutputMode.PORCELAIN:
+        renderer.write(f"summary\tproblems={len(problems)}\tentries={len(pairs)}")
+    else:
+        if problems and renderer.mode == OutputMode.NORMAL:
+            renderer.write()
+        renderer.write(f"Summary: {len(problems)} problems in {len(pairs)} entries.")
+    renderer.flush()
+
+    return len(problems)
+
+
+def discover_files(emit_stubs: bool = False) -> None:
+    """Print the repository files that are not managed by the manifest.
+
+    Files are managed when they, or a parent directory, are defined in the
+    manifest, or when they are the template of a generated file.
+
+    :param emit_stubs: whether to print the unmanaged files as manifest
+        definitions to fill in or not.
+
+    """
+    import json
+
+    definitions = load_manifest_definitions()
+    trie = ManifestTrie(definitions)
+    templates = {
+        definition["template"]
+        for definition in definitions.values()
+        if isinstance(definition, dict) and definition.get("template")
+    }
+    repo_index = index_repo_tree(use_git=True)
+    unmanaged_files = sorted(
+        relpath
+        for relpath in repo_index.files
+        if relpath not in templates and not trie.covers(relpath)
+    )
+
+    if emit_stubs:
+        stubs = {relpath: {"description": "", "packages": []} for relpath in unmanaged_files}
+        renderer.write(json.dumps(stubs, indent=2))
+        renderer.flush()
+        return
+
+    if renderer.mode == OutputMode.PORCELAIN:
+        for relpath in unmanaged_files:
+            renderer.write(f"unmanaged\t{relpath}")
+        renderer.write(f"summary\tunmanaged={len(unmanaged_files)}\tfiles={len(repo_index.files)}")
+        renderer.flush()
+        return
+
+    if unmanaged_files and renderer.mode == OutputMode.NORMAL:
+        renderer.write(f"Repository files not defined in `{ALL_FILES_PATH.name}`:\n")
+    for relpath in unmanaged_files:
+        renderer.write(str(REPO_HOME_PATH / relpath), colour.fg_yellow)
+    if unmanaged_files and renderer.mode == OutputMode.NORMAL:
+        renderer.write()
+    renderer.write(
+        f"Summary: {len(unmanaged_files)} unmanaged of {len(repo_index.files)} repository files."
+    )
+    renderer.flush()
+
+
+def load_manifest(
+    patterns: Optional[Iterable[str]] = None, exclude: Iterable[str] = (), check_repo: bool = True
+) -> List[HomeFile]:
+    """Load the files of the manifest matching the selection patterns.
+
+    Every pattern may be a key, a directory prefix or a glob, and patterns
+    starting with ``!`` exclude files.
+
+    :param patterns: selection patterns, None to select every file.
+    :param exclude: patterns of the files left out.
+    :param check_repo: whether to check that the repository files exist or
+        not, which is not needed to delete them.
+    :returns: the selected files sorted by their relative path.
+    :raises BackstoreError: if a pattern does not match any file, a definition
+        is malformed or a repository file does not exist.
+
+    """
+    # Load all files metadata
+    with profiler.phase("manifest load"):
+        all_files = load_manifest_definitions()
+
+    # Obtain selection patterns. Patterns starting with `!` exclude files
+    select_all = patterns is None
+    patterns = list(patterns or [])
+    patterns.extend(f"!{pattern}" for pattern in exclude)
+    selected_files: Iterable[str] = all_files if select_all else []
+
+    # Resolve the patterns against the manifest paths
+    if patterns:
+        trie = ManifestTrie(all_files)
+        included = [pattern for pattern in patterns if not pattern.startswith("!")]
+        excluded = [pattern[1:] for pattern in patterns if pattern.startswith("!")]
+        selected = set(all_files) if select_all or not included else set()
+
+        for pattern in included:
+            matches = trie.match(pattern)
+            if not matches:
+                raise BackstoreError(f"`{pattern}` was not found in `{str(ALL_FILES_PATH)}` file")
+            selected.update(matches)
+        for pattern in excluded:
+            selected.difference_update(trie.match(pattern))
+
+        selected_files = selected
+
+    chosen_files: List[HomeFile] = []
+
+    # Create a list of selected files
+    for file_path in selected_files:
+        try:
+            chosen_files.append(HomeFile(file_path, **all_files[file_path]))
+        except KeyError:
+            raise BackstoreError(f"`{file_path}` was not found in `{str(ALL_FILES_PATH)}` file")
+        except TypeError as error:
+            raise BackstoreError(f"Problem parsing `{file_path}`: {str(error)}.")
+
+    # Check if every selected file exists in the repository
+    if check_repo:
+        with profiler.phase("repository check"):
+            # Walking the whole repository only pays off for large selections,
+            # otherwise an empty index checks each file with a single lstat
+            if len(chosen_files) >= REPO_INDEX_MIN_FILES:
+                repo_index = index_repo_tree()
+            else:
+                repo_index = RepoIndex(set(), set())
+            for file in chosen_files:
+                if not repo_index.exists(file.template or file.relpath):
+                    raise BackstoreError(
+                        f"File `{str(REPO_HOME_PATH / (file.template or file.relpath))}` "
+                        "from selected files does not exist."
+                    )
+
+    return sorted(chosen_files, key=lambda file: file.relpath)
+
+
+def plan(
+    selected_files: List[HomeFile],
+    action: str = "link",
+    force: bool = False,
+    jobs: int = 1,
+    incremental: bool = True,
+    fold: bool = False,
+    mode: InstallMode = InstallMode.SYMLINK,
+    package_backend: str = "auto",
+) -> List[PlanAction]:
+    """Plan the operations needed to link or delete the selected files.
+
+    :param selected_files: files returned by :func:`load_manifest`.
+    :param action: ``link`` or ``delete``.
+    :param force: whether to replace or delete files not installed from the
+        repository or not.
+    :param jobs: number of files inspected at the same time.
+    :param incremental: whether to use the state database or not, only used
+        when linking.
+    :param fold: whether to link or delete fully managed directories as a
+        whole or not.
+    :param mode: how the files are installed.
+    :param package_backend: name of the package backend checking the
+        dependencies.
+    :returns: the planned operations.
+
+    """
+    if action == "link":
+        return plan_link(selected_files, force, jobs, incremental, fold, mode, package_backend)[1]
+    elif action == "delete":
+        return plan_delete(selected_files, force, jobs, fold, mode)[2]
+
+    raise ValueError(f"Unknown action `{action}`, use `link` or `delete`.")
+
+
+def apply(actions: List[PlanAction], jobs: int = 1, verify: bool = True) -> Iterator[FileResult]:
+    """Perform the planned operations, yielding the result of each one as
+    soon as it finishes, in plan order.
+
+    Closing the generator stops performing the remaining operations. The
+    state database used by incremental runs is not updated.
+
+    :param actions: operations returned by :func:`plan` or :func:`load_plan`.
+    :param jobs: maximum number of operations performed at the same time.
+    :param verify: whether to check that the files did not change since the
+        plan was computed or not.
+    :returns: an iterator over the result of each operation.
+
+    """
+    yield from apply_plan(actions, jobs, verify)
+
+
+def load_files_list(args: "Namespace") -> List[HomeFile]:
+    """Load selected files.
+
+    Files are selected from :data:`SEL_FILES_PATH` unless ``--all`` or
+    ``--only`` are used.
+
+    :param args: command line arguments.
+    :returns: the selected files sorted by their relative path.
+
+    """
+    if args.all:
+        patterns = None
+    elif args.only:
+        patterns = list(args.only)
+    else:
+        with SEL_FILES_PATH.open() as f:
+            patterns = list(filter(None, map(str.strip, f.read().splitlines())))
+
+    return load_manifest(
+        patterns,
+        args.exclude,
+        check_repo=not args.delete and not args.restore and args.plan != "delete",
+    )
+
+
+def load_homes(args: "Namespace") -> List[Path]:
+    """Load the home directories chosen with ``--home`` and ``--homes-file``.
+
+    :param args: command line arguments.
+    :returns: the absolute home directories, without duplicates.
+
+    """
+    homes = list(args.home)
+
+    if args.homes_file:
+        try:
+            with open(args.homes_file) as f:
+                homes.extend(
+                    line.strip() for line in f if line.strip() and not line.startswith("#")
+                )
+        except OSError as error:
+            sys.exit(f"ERROR: Could not read `{args.homes_file}`: {error.strerror}.")
+
+    home_paths: Dict[Path, None] = {}
+    for home in homes:
+        home_path = Path(home).expanduser().absolute()
+        if not home_path.is_dir():
+            sys.exit(f"ERROR: Home directory `{str(home_path)}` does not exist.")
+        home_paths[home_path] = None
+
+    return list(home_paths)
+
+
+def home_state_file_path(home_path: Path) -> Path:
+    """Obtain the state database of a home directory.
+
+    :param home_path: home directory.
+    :returns: :data:`USER_STATE_FILE_PATH` for the user home directory, or a
+        file named after the directory digest otherwise.
+
+    """
+    import hashlib
+
+    # STATE_FILE_PATH is rebound for each home run by a worker
+    if home_path == Path.home():
+        return USER_STATE_FILE_PATH
+
+    digest = hashlib.sha1(str(home_path).encode()).hexdigest()[:16]
+    return USER_STATE_FILE_PATH.with_name(f".backstore_state.{digest}.json")
+
+
+class HomeWorkerContext(NamedTuple):
+    """Data shared by the processes running the action in each home.
+
+    :ivar args: command line arguments.
+    :ivar selected_files: list of selected files.
+    :ivar output_mode: amount and format of the output.
+    :ivar colours: whether to apply the styles or not.
+    :ivar package_databases: already opened package databases.
+
+    """
+
+    args: "Namespace"
+    selected_files: List[HomeFile]
+    output_mode: OutputMode
+    colours: bool
+    package_databases: Dict[str, Optional[PackageDatabase]]
+
+
+home_worker_context: Optional[HomeWorkerContext] = None
+
+
+def init_home_worker(context: HomeWorkerContext) -> None:
+    """Receive the shared data once per worker process.
+
+    :param context: data shared by every home.
+
+    """
+    global home_worker_context
+
+    home_worker_context = context
+    renderer.mode = context.output_mode
+    renderer.colours = context.colours
+    package_databases.update(context.package_databases)
+
+
+def run_home(home_path: Path) -> Tuple[Path, str, Optional[str]]:
+    """Run the action in a home directory of a worker process.
+
+    :param home_path: home directory.
+    :returns: the home directory, its output and the error message, if any.
+
+    """
+    import io
+
+    global HOME_PATH, STATE_FILE_PATH
+
+    HOME_PATH = home_path
+    STATE_FILE_PATH = home_state_file_path(home_path)
+    renderer.stream = io.StringIO()
+    list_repo_directory.cache_clear()
+    error = None
+
+    try:
+        run_selected_action(
+            home_worker_context.args, home_worker_context.selected_files, confirm=False
+        )
+    except SystemExit as exit_error:
+        error = str(exit_error.code) if exit_error.code else None
+    except BackstoreError as exception:
+        error = f"ERROR: {exception}"
+    except Exception as exception:
+        error = f"ERROR: {exception!r}"
+
+    renderer.flush()
+    return home_path, renderer.stream.getvalue(), error
+
+
+def run_homes(args: "Namespace", selected_files: List[HomeFile], homes: List[Path]) -> None:
+    """Run the action in many home directories with a process pool.
+
+    The selected files and the package database are loaded once and sent to
+    each worker process, which runs the action in its homes and returns the
+    output. Outputs are printed in order, each under a heading with the home
+    directory or, in porcelain mode, with the home directory as an extra first
+    field of each line.
+
+    :param args: command line arguments.
+    :param selected_files: list of selected files.
+    :param homes: home directories.
+
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    if args.delete and not ask_confirmation(
+        f"Are you sure you want to delete previous links of {len(homes)} home directories?"
+    ):
+        if renderer.mode == OutputMode.NORMAL:
+            renderer.write("\nAborting symlinks deletion.")
+        renderer.flush()
+        return
+
+    if (args.link or args.plan == "link") and any(file.packages for file in selected_files):
+        with profiler.phase("package query"):
+            package_database = open_package_database(args.package_backend)
+            # Load it here so the workers receive the parsed packages
+            if package_database is not None:
+                package_database.load()
+
+    renderer.flush()
+    context = HomeWorkerContext(
+        args, selected_files, renderer.mode, renderer.colours, dict(package_databases)
+    )
+    errors: List[str] = []
+
+    with profiler.phase("homes"), ProcessPoolExecutor(
+        min(len(homes), os.cpu_count() or 1), initializer=init_home_worker, initargs=(context,)
+    ) as executor:
+        for home_path, output, error in executor.map(run_home, homes):
+            if renderer.mode == OutputMode.PORCELAIN:
+                for line in output.splitlines():
+                    renderer.write(f"{str(home_path)}\t{line}")
+            else:
+                renderer.write(apply_style(f"==> {str(home_path)} <==", colour.bold))
+                renderer.write(output)
+            renderer.flush()
+            if error:
+                print(f"{str(home_path)}: {error}", file=sys.stderr)
+                errors.append(str(home_path))
+
+    if errors:
+        sys.exit(f"ERROR: The action failed in {len(errors)} home directories.")
+
+
+def run_action(args: "Namespace") -> None:
+    """Run the action chosen in the command line.
+
+    :param args: command line arguments.
+
+    """
+    if args.check:
+        if check_manifest():
+            sys.exit(1)
+        return
+
+    if args.discover:
+        discover_files(args.discover == "stubs")
+        return
+
+    homes = load_homes(args)
+
+    if args.apply and homes:
+        sys.exit("ERROR: Plans can not be applied to other home directories.")
+
+    if args.audit and not homes:
+        audit_links(args.jobs or min(32, (os.cpu_count() or 1) + 4))
+        return
+
+    args.jobs = args.jobs or 1
+
+    if args.apply:
+        results = print_results(apply_plan(load_plan(args.apply), args.jobs))
+        failed = sum(result.outcome == Outcome.FAILED for result in results)
+        if failed:
+            raise BackstoreError(f"{failed} entries of the plan could not be applied.")
+        return
+
+    selected_files: List[HomeFile] = []
+
+    if not args.audit:
+        selected_files = load_files_list(args)
+        if not selected_files:
+            sys.exit("ERROR: There aren't selected files.")
+
+    # Read the package database while the files are inspected
+    if (args.link or args.plan == "link") and any(file.packages for file in selected_files):
+        package_database = open_package_database(args.package_backend)
+        if package_database is not None:
+            package_database.prefetch()
+
+    if homes:
+        # Packages are installed once for the whole machine
+        if args.install:
+            if not install_missing_packages(
+                selected_files, args.package_backend, args.install_command
+            ):
+                raise BackstoreError("Could not install the missing dependencies.")
+            args.install = False
+        run_homes(args, selected_files, homes)
+    else:
+        run_selected_action(args, selected_files)
+
+
+def run_selected_action(
+    args: "Namespace", selected_files: List[HomeFile], confirm: bool = True
+) -> None:
+    """Run the action chosen in the command line over the selected files.
+
+    :param args: command line arguments.
+    :param selected_files: list of selected files.
+    :param confirm: whether to ask for confirmation before deleting or not.
+
+    """
+    mode = InstallMode(args.mode)
+
+    if args.audit:
+        audit_links(args.jobs)
+    elif args.print:
+        print_header("Listing selected files.")
+        print_selected_files(selected_files, snapshot_files(selected_files, args.jobs, mode))
+    elif args.link:
+        print_header("Linking selected files.")
+        link_selected_files(
+            selected_files,
+            args.force,
+            install=args.install,
+            jobs=args.jobs,
+            incremental=not args.full,
+            fold=args.fold,
+            mode=mode,
+            package_backend=args.package_backend,
+            install_command=args.install_command,
+        )
     elif args.delete:
-        print(f"Deleting selected links.\n")
-        delete_selected_links(selected_files, args.force)
+        print_header("Deleting selected links.")
+        delete_selected_links(selected_files, args.force, args.jobs, args.fold, mode, confirm)
+    elif args.restore:
+        print_header("Restoring selected files.")
+        restore_selected_files(selected_files, args.force, args.jobs, mode)
+    elif args.plan == "link":
+        print_plan(
+            plan_link(
+                selected_files,
+                args.force,
+                args.jobs,
+                not args.full,
+                args.fold,
+                mode,
+                args.package_backend,
+            )[1],
+            args.format,
+        )
+    elif args.plan == "delete":
+        print_plan(
+            plan_delete(selected_files, args.force, args.jobs, args.fold, mode)[2], args.format
+        )
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    actions_group = parser.add_mutually_exclusive_group(required=True)
+    actions_group.add_argument("-p", "--print", action="store_true", help="print selected files")
+    actions_group.add_argument("-l", "--link", action="store_true", help="link selected files")
+    actions_group.add_argument(
+        "-d",
+        "--delete",
+        action="store_true",
+        help="delete selected local symlinks",
+    )
+    actions_group.add_argument(
+        "--plan",
+        action="store",
+        nargs="?",
+        const="link",
+        choices=("link", "delete"),
+        help="print the operations needed to link (default) or delete the selected files "
+        "without performing them",
+    )
+    actions_group.add_argument(
+        "--audit",
+        action="store_true",
+        help="find links in the home directory to the repository that are dangling or not "
+        "defined in files.json",
+    )
+    actions_group.add_argument(
+        "--discover",
+        action="store",
+        nargs="?",
+        const="list",
+        choices=("list", "stubs"),
+        help="print the repository files not defined in files.json (default), or definition "
+        "stubs to add them",
+    )
+    actions_group.add_argument(
+        "--check",
+        action="store_true",
+        help="validate files.json and exit with an error status if there are problems",
+    )
+    actions_group.add_argument(
+        "--restore",
+        action="store_true",
+        help="restore the latest backup of the selected files, taken when they were replaced "
+        "or deleted using --force",
+    )
+    actions_group.add_argument(
+        "--apply",
+        action="store",
+        metavar="PLAN",
+        help="perform the operations of a plan file (`-` reads the standard input)",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="force linking and deleting symlinks",
+    )
+    number_group = parser.add_mutually_exclusive_group(required=False)
+    number_group.add_argument(
+        "-a", "--all", action="store_true", help="perform action for all files"
+    )
+    number_group.add_argument(
+        "-o",
+        "--only",
+        action="append",
+        metavar="PATTERN",
+        help="perform action only for the files matching a key, directory prefix or glob "
+        "(e.g. `.config/qtile/**` or `.local/bin/*.py`), can be repeated",
+    )
+    parser.add_argument(
+        "-x",
+        "--exclude",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="leave out the files matching the pattern, can be repeated",
+    )
+    parser.add_argument(
+        "-m",
+        "--mode",
+        action="store",
+        choices=tuple(mode.value for mode in InstallMode),
+        default=InstallMode.SYMLINK.value,
+        help="how files are installed: symbolic links to the repository (default), copies, "
+        "hard links or reflinks (copy-on-write clones, falling back to copies)",
+    )
+    parser.add_argument(
+        "--fold",
+        action="store_true",
+        help="link and delete fully managed directories as a whole",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="ignore the state of previous runs and examine every selected file",
+    )
+    parser.add_argument(
+        "--package-backend",
+        action="store",
+        choices=("auto",) + tuple(backend.name for backend in PACKAGE_BACKENDS),
+        default="auto",
+        help="package database checking the dependencies (default: the first one found)",
+    )
+    parser.add_argument(
+        "--install",
+        action="store_true",
+        help="install the missing dependencies of the linked files in a single package manager "
+        "transaction",
+    )
+    parser.add_argument(
+        "--install-command",
+        action="store",
+        default=os.environ.get("BACKSTORE_INSTALL_COMMAND"),
+        metavar="COMMAND",
+        help="command line installing the packages given after it (default: the package "
+        "manager of the backend, through sudo unless running as root), also set with the "
+        "BACKSTORE_INSTALL_COMMAND environment variable",
+    )
+    parser.add_argument(
+        "--format",
+        action="store",
+        choices=("json", "ndjson"),
+        default="ndjson",
+        help="output format of --plan (default: ndjson)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        type=int,
+        metavar="N",
+        help="number of files processed at the same time (default: 1, or the thread pool "
+        "default for --audit)",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store",
+        type=int,
+        nargs="?",
+        const=10,
+        metavar="N",
+        help="print the time spent in each phase and the N slowest files (default: 10) to "
+        "the standard error, also enabled with the BACKSTORE_PROFILE environment variable",
+    )
+    parser.add_argument(
+        "--profile-dump",
+        action="store",
+        metavar="FILE",
+        help="store cProfile statistics of the run, readable with pstats",
+    )
+    parser.add_argument(
+        "--home",
+        action="append",
+        default=[],
+        metavar="DIR",
+        help="run the action in this home directory instead of the user one, can be repeated "
+        "to run it in many of them at the same time",
+    )
+    parser.add_argument(
+        "--homes-file",
+        action="store",
+        metavar="FILE",
+        help="run the action in the home directories listed in the file, one by line",
+    )
+    output_group = parser.add_mutually_exclusive_group(required=False)
+    output_group.add_argument(
+        "-q",
+        "--quiet",
+        action="store_true",
+        help="only print the files that need changes and the summary",
+    )
+    output_group.add_argument(
+        "--porcelain",
+        action="store_true",
+        help="like --quiet, as tab separated lines without colours, for scripts",
+    )
+
+    args = parser.parse_args()
+
+    if args.quiet:
+        renderer.mode = OutputMode.QUIET
+    elif args.porcelain:
+        renderer.mode = OutputMode.PORCELAIN
+        renderer.colours = False
+
+    if args.jobs is not None and args.jobs < 1:
+        sys.exit("ERROR: The number of jobs must be at least 1.")
+
+    if args.install and not args.link:
+        sys.exit("ERROR: Dependencies can only be installed while linking.")
+
+    profile_slowest = args.profile
+    if profile_slowest is None and os.environ.get("BACKSTORE_PROFILE"):
+        try:
+            profile_slowest = int(os.environ["BACKSTORE_PROFILE"])
+        except ValueError:
+            profile_slowest = 10
+    if profile_slowest is not None or args.profile_dump:
+        profiler.enable(10 if profile_slowest is None else profile_slowest)
+
+    profile = None
+    if args.profile_dump:
+        import cProfile
+
+        profile = cProfile.Profile()
+        profile.enable()
+
+    try:
+        run_action(args)
+    except BackstoreError as error:
+        sys.exit(f"ERROR: {error}")
+    finally:
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(args.profile_dump)
+        renderer.flush()
+        profiler.report()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""Benchmark backstore.
+
+This tool measures ``backstore.py`` against synthetic repositories. For every
+size, a temporary repository is generated with a ``files.json`` manifest of
+that many entries and the matching ``home`` tree, and a copy of
+``backstore.py`` is placed in its ``automation`` directory, so its repository
+and ``$HOME`` paths point to the temporary directory.
+
+Each run times ``--print``, ``--link``, ``--link --force`` and ``--delete`` of
+every file, in that order, starting from an empty ``$HOME``. The results can
+be stored as JSON and compared against a previous run.
+
+Some usage examples:
+
+* Benchmark the default sizes:
+  ::
+
+      python benchmark.py
+
+* Store a baseline and compare a later run against it:
+  ::
+
+      python benchmark.py --output baseline.json
+      python benchmark.py --baseline baseline.json
+
+"""
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+AUTOMATION_PATH: Path = Path(__file__).resolve().parent
+BACKSTORE_PATH: Path = AUTOMATION_PATH / "backstore.py"
+DEFAULT_SIZES: List[int] = [1000, 10000, 100000]
+SEED: int = 0
+
+
+class Command(NamedTuple):
+    """Benchmarked backstore invocation.
+
+    :ivar name: name of the command in the results.
+    :ivar arguments: backstore arguments.
+    :ivar stdin: text written to the standard input.
+
+    """
+
+    name: str
+    arguments: List[str]
+    stdin: str = ""
+
+
+COMMANDS: List[Command] = [
+    Command("print", ["--print", "--all"]),
+    Command("link", ["--link", "--all"]),
+    Command("link-force", ["--link", "--force", "--all"]),
+    Command("delete", ["--delete", "--all"], "yes\n"),
+]
+
+
+def generate_repository(repository_path: Path, size: int) -> None:
+    """Generate a synthetic repository with a manifest of ``size`` entries.
+
+    Files are spread over nested directories of up to a hundred files each,
+    with the same seed on every run so the trees are reproducible.
+
+    :param repository_path: directory where the repository is created.
+    :param size: number of manifest entries.
+
+    """
+    generator = random.Random(SEED)
+    repo_home_path = repository_path / "home"
+    automation_path = repository_path / "automation"
+    automation_path.mkdir(parents=True)
+    definitions: Dict[str, Dict] = {}
+
+    for index in range(size):
+        depth = generator.randint(0, 2)
+        parents = [f".bench{index // 100:04d}"] + [f"level{level}" for level in range(depth)]
+        relpath = os.path.join(*parents, f"file{index % 100:02d}.conf")
+        file_path = repo_home_path / relpath
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_text(f"# Synthetic file {index}.\n")
+        definitions[relpath] = {"description": f"Synthetic file {index}."}
+
+    with (automation_path / "files.json").open("w") as f:
+        json.dump(definitions, f, indent=2)
+
+    shutil.copy2(BACKSTORE_PATH, automation_path / "backstore.py")
+
+
+def run_command(repository_path: Path, home_path: Path, command: Command) -> float:
+    """Run a backstore command against the synthetic repository.
+
+    :param repository_path: synthetic repository directory.
+    :param home_path: directory used as ``$HOME``.
+    :param command: command to run.
+    :returns: the elapsed wall time in seconds.
+
+    """
+    environment = dict(os.environ, HOME=str(home_path), NO_COLOR="1")
+    start_time = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, str(repository_path / "automation" / "backstore.py")] + command.arguments,
+        input=command.stdin,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        env=environment,
+        text=True,
+    )
+    elapsed_time = time.perf_counter() - start_time
+
+    if process.returncode != 0:
+        sys.exit(f"ERROR: `{command.name}` failed:\n{process.stderr}")
+
+    return elapsed_time
+
+
+def benchmark_size(size: int, repeat: int, keep: bool = False) -> Dict[str, Dict]:
+    """Benchmark every command against a repository of ``size`` entries.
+
+    :param size: number of manifest entries.
+    :param repeat: number of runs of the whole command sequence.
+    :param keep: whether to keep the temporary directory or not.
+    :returns: the timings of each command indexed by its name.
+
+    """
+    temporary_path = Path(tempfile.mkdtemp(prefix=f"backstore-bench-{size}-"))
+    repository_path = temporary_path / "repo"
+    home_path = temporary_path / "home"
+    timings: Dict[str, List[float]] = {command.name: [] for command in COMMANDS}
+
+    try:
+        generate_repository(repository_path, size)
+        for _ in range(repeat):
+            shutil.rmtree(home_path, ignore_errors=True)
+            home_path.mkdir()
+            for command in COMMANDS:
+                timings[command.name].append(run_command(repository_path, home_path, command))
+    finally:
+        if keep:
+            print(f"Keeping `{str(temporary_path)}`.", file=sys.stderr)
+        else:
+            shutil.rmtree(temporary_path, ignore_errors=True)
+
+    return {
+        name: {"runs": runs, "median": statistics.median(runs), "min": min(runs)}
+        for name, runs in timings.items()
+    }
+
+
+def compare_results(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Print the results next to the baseline ones.
+
+    :param results: current benchmark results.
+    :param baseline: previous benchmark results.
+    :param threshold: relative slowdown of the median considered a
+        regression.
+    :returns: the ``size/command`` keys that regressed.
+
+    """
+    regressions: List[str] = []
+
+    print(f"\n{'size':>8} {'command':<12} {'baseline':>10} {'current':>10} {'change':>8}")
+    for size, commands in results["sizes"].items():
+        for name, timing in commands.items():
+            previous = baseline["sizes"].get(size, {}).get(name)
+            if previous is None:
+                continue
+            change = timing["median"] / previous["median"] - 1
+            marker = ""
+            if change > threshold:
+                marker = " !"
+                regressions.append(f"{size}/{name}")
+            print(
+                f"{size:>8} {name:<12} {previous['median']:>9.3f}s {timing['median']:>9.3f}s "
+                f"{change:>+7.1%}{marker}"
+            )
+
+    return regressions
+
+
+def main() -> None:
+    """Main function."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark backstore with synthetic manifests.")
+    parser.add_argument(
+        "-s",
+        "--sizes",
+        action="store",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        metavar="N",
+        help="number of manifest entries of each benchmark (default: 1000 10000 100000)",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        action="store",
+        type=int,
+        default=3,
+        metavar="N",
+        help="number of runs of each benchmark (default: 3)",
+    )
+    parser.add_argument(
+        "-o", "--output", action="store", metavar="FILE", help="store the results as JSON"
+    )
+    parser.add_argument(
+        "-b",
+        "--baseline",
+        action="store",
+        metavar="FILE",
+        help="compare the results against a previously stored JSON file",
+    )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        action="store",
+        type=float,
+        default=0.1,
+        help="relative slowdown considered a regression (default: 0.1)",
+    )
+    parser.add_argument(
+        "--keep", action="store_true", help="keep the generated temporary directories"
+    )
+
+    args = parser.parse_args()
+
+    if args.repeat < 1 or any(size < 1 for size in args.sizes):
+        sys.exit("ERROR: Sizes and the number of runs must be at least 1.")
+
+    baseline: Optional[Dict] = None
+    if args.baseline:
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        except (OSError, json.JSONDecodeError) as error:
+            sys.exit(f"ERROR: Could not read the baseline `{args.baseline}`: {error}")
+
+    results: Dict = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "sizes": {},
+    }
+
+    print(f"{'size':>8} {'command':<12} {'median':>10} {'min':>10}")
+    for size in args.sizes:
+        timings = benchmark_size(size, args.repeat, args.keep)
+        results["sizes"][str(size)] = timings
+        for name, timing in timings.items():
+            print(f"{size:>8} {name:<12} {timing['median']:>9.3f}s {timing['min']:>9.3f}s")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare_results(results, baseline, args.threshold)
+        if regressions:
+            sys.exit(f"ERROR: Slower than the baseline: {', '.join(regressions)}.")
+
+
+if __name__ == "__main__":
+    main()
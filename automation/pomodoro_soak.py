@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""Soak test the pomodoro timer.
+
+This tool drives ``home/.local/bin/pomodoro.py`` through a million pomodoro
+cycles by default, injecting a fake clock whose sleeps advance the time
+instantly. Every notification is checked against the expected sequence of
+stages and deadlines, halfway through the run the computer is suspended for
+four hours, and the number of allocated memory blocks must stay flat.
+
+Some usage examples:
+
+* Run the default million cycles:
+  ::
+
+      python pomodoro_soak.py
+
+* Run a quick check:
+  ::
+
+      python pomodoro_soak.py --cycles 10000
+
+"""
+import importlib.util
+import sys
+import time
+
+from pathlib import Path
+from typing import List
+
+AUTOMATION_PATH: Path = Path(__file__).resolve().parent
+POMODORO_PATH: Path = AUTOMATION_PATH.parent / "home" / ".local" / "bin" / "pomodoro.py"
+START_TIME: float = 1_700_000_000.0
+SUSPEND_TIME: int = 4 * 60 * 60
+MAX_BLOCKS_GROWTH: int = 1000
+
+
+def load_pomodoro():
+    """Import the pomodoro module from the repository.
+
+    No bytecode cache is written, so the dotfiles tree is left untouched.
+
+    :returns: the pomodoro module.
+
+    """
+    spec = importlib.util.spec_from_file_location("pomodoro", POMODORO_PATH)
+    module = importlib.util.module_from_spec(spec)
+    dont_write_bytecode = sys.dont_write_bytecode
+    sys.dont_write_bytecode = True
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.dont_write_bytecode = dont_write_bytecode
+    return module
+
+
+class FakeClock(object):
+    """Clock whose sleeps advance the time instantly.
+
+    :ivar now: current time in seconds since epoch.
+    :ivar suspend: seconds added to the next sleep, as if the computer was
+        suspended meanwhile.
+
+    """
+
+    def __init__(self, now: float = START_TIME):
+        """Fake clock constructor.
+
+        :param now: initial time in seconds since epoch.
+
+        """
+        self.now: float = now
+        self.suspend: int = 0
+
+    def time(self) -> float:
+        """Obtain the current time.
+
+        :returns: the current time in seconds since epoch.
+
+        """
+        return self.now
+
+    def sleep(self, delay: float) -> None:
+        """Advance the time.
+
+        :param delay: seconds to sleep.
+
+        """
+        self.now += max(delay, 0) + self.suspend
+        self.suspend = 0
+
+
+class SoakCheck(object):
+    """Notification callable checking the timer sequence.
+
+    :ivar errors: description of the unexpected notifications.
+    :ivar notifications: number of pomodoro notifications received.
+    :ivar blocks: allocated memory blocks after the warm up and at the end.
+
+    """
+
+    def __init__(self, pomodoro, clock: FakeClock, cycles: int):
+        """Soak check constructor.
+
+        :param pomodoro: pomodoro module.
+        :param clock: fake clock driving the timer.
+        :param cycles: number of pomodoro cycles to run.
+
+        """
+        self.errors: List[str] = []
+        self.notifications: int = 0
+        self.blocks: List[int] = []
+        self.timer = pomodoro.PomodoroTimer(self, clock.time, clock.sleep)
+        self.__service = pomodoro.TimerService
+        self.__clock: FakeClock = clock
+        self.__cycles: int = cycles
+        self.__expected_time: float = clock.now + pomodoro.TimerService.DELTA_START_TIME
+        self.__suspended: bool = False
+
+    def __check(self, condition: bool, message: str) -> None:
+        """Record an error unless the condition holds.
+
+        Only the first errors are kept, so a broken timer does not fill the
+        memory.
+
+        :param condition: whether the notification is the expected one.
+        :param message: description of the error.
+
+        """
+        if not condition and len(self.errors) < 10:
+            self.errors.append(f"Notification {self.notifications}: {message}")
+
+    def __call__(self, title: str, body: str = "") -> None:
+        """Check a notification of the timer.
+
+        :param title: title of the notification.
+        :param body: body of the notification.
+
+        """
+        if title == "Pomodoro Timer" or title.startswith("Stopping"):
+            return
+
+        cycle, ended = divmod(self.notifications, 2)
+        stage = cycle % 4 + 1
+        expected_title = f"POM[{stage}]::END." if ended else f"POM[{stage}]::START."
+        self.__check(title.startswith(expected_title), f"`{title}` is not `{expected_title}`.")
+
+        if self.__suspended:
+            # Only this late notification is sent, and the schedule starts
+            # again from the current time
+            self.__check(
+                self.__clock.now == self.__expected_time + SUSPEND_TIME,
+                "The suspended phase did not end once the computer resumed.",
+            )
+            self.__expected_time = self.__clock.now
+            self.__suspended = False
+        self.__check(
+            self.__clock.now == self.__expected_time,
+            f"Sent at {self.__clock.now}, expected at {self.__expected_time}.",
+        )
+
+        if ended:
+            self.__expected_time += (
+                self.__service.DELTA_LONG_BREAK_TIME
+                if stage == 4
+                else self.__service.DELTA_SHORT_BREAK_TIME
+            )
+        else:
+            self.__expected_time += self.__service.DELTA_POMODORO_TIME
+
+        self.notifications += 1
+        if self.notifications == self.__cycles // 10 * 2:
+            self.blocks.append(sys.getallocatedblocks())
+        elif self.notifications == self.__cycles:
+            self.__clock.suspend = SUSPEND_TIME
+            self.__suspended = True
+        elif self.notifications == self.__cycles * 2:
+            self.blocks.append(sys.getallocatedblocks())
+            self.timer.stop()
+
+
+def run_soak(cycles: int) -> List[str]:
+    """Drive the timer through the cycles.
+
+    :param cycles: number of pomodoro cycles to run.
+    :returns: the errors found.
+
+    """
+    check = SoakCheck(load_pomodoro(), FakeClock(), cycles)
+    start_time = time.perf_counter()
+    check.timer.run()
+    elapsed_time = time.perf_counter() - start_time
+
+    print(
+        f"{check.notifications} notifications ({check.notifications // 2} cycles) in "
+        f"{elapsed_time:.1f}s."
+    )
+
+    errors = list(check.errors)
+    if check.notifications != cycles * 2:
+        errors.append(f"The timer stopped after {check.notifications} notifications.")
+    elif check.blocks[1] - check.blocks[0] > MAX_BLOCKS_GROWTH:
+        errors.append(f"Allocated memory blocks grew from {check.blocks[0]} to {check.blocks[1]}.")
+
+    return errors
+
+
+def main() -> None:
+    """Main function."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Soak test the pomodoro timer with a fake clock.")
+    parser.add_argument(
+        "-c",
+        "--cycles",
+        action="store",
+        type=int,
+        default=1_000_000,
+        metavar="N",
+        help="number of pomodoro cycles (default: 1000000)",
+    )
+
+    args = parser.parse_args()
+
+    if args.cycles < 10:
+        sys.exit("ERROR: The number of cycles must be at least 10.")
+
+    errors = run_soak(args.cycles)
+    if errors:
+        sys.exit("ERROR: " + "\n".join(errors))
+
+
+if __name__ == "__main__":
+    main()
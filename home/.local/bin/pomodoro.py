@@ -7,7 +7,8 @@ get a longer break (15 minutes).
 
 It is possible to run the timer within a new process or the main one. This is
 just for demostrating purposes in case you want to run the timer while running
-other code.
+other code. Many named timers can also share one asyncio event loop using
+``TimerService``.
 
 .. code-block:: console
 
@@ -19,11 +20,13 @@ other code.
 
 """
 import argparse
+import asyncio
+import heapq
+import itertools
 import json
 import logging
 import multiprocessing
 import os
-import sched
 import sys
 import time
 import urllib.parse
@@ -31,13 +34,14 @@ import urllib.request
 
 from enum import Enum
 from os import environ
-from sched import Event
-from typing import Callable, Dict, List, Optional
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
 from urllib.error import HTTPError, URLError
 
 TG_BOT_TOKEN = ""
 TG_MY_ID = ""
 
+NotificationCallable = Callable[[str, str], Union[None, Awaitable[None]]]
+
 
 class Notifier(Enum):
     TELEGRAM = 0
@@ -45,6 +49,13 @@ class Notifier(Enum):
     ALL = 2
 
 
+class Phase(Enum):
+    """Pomodoro timer phase."""
+
+    POMODORO = 0
+    BREAK = 1
+
+
 def send_desktop_notification(title: str, body: str = "") -> None:
     """Send a desktop notificatino with the title and body provided.
 
@@ -100,55 +111,126 @@ def send_telegram_notification(title: str, body: str = "") -> None:
             print("*" * 79)
 
 
-class PomodoroTimer(object):
-    """Pomodoro timer.
+class Timer(object):
+    """State of a named Pomodoro timer.
 
-    This class allow to run a Pomodoro Timer notifying when time slots expire.
+    :ivar name: timer name.
+    :ivar notification_callable: callable or coroutine function with
+        ``title`` and ``body`` as arguments to call when a phase ends.
+    :ivar phase: current phase.
+    :ivar stage: current Pomodoro stage, or the next one during breaks.
+    :ivar deadline: ending time of the current phase in seconds since epoch.
+
+    """
+
+    __slots__ = ("name", "notification_callable", "phase", "stage", "deadline")
+
+    def __init__(
+        self,
+        name: str,
+        notification_callable: NotificationCallable,
+        phase: Phase,
+        stage: int,
+        deadline: float,
+    ):
+        """Timer constructor.
 
-    :ivar __time_callable: :func:`time.time`-like callable to manage sheduled
-        events and notify current time.
-    :ivar __scheduler: :class:`sched.scheduler` instance for performing timer
-        operations.
-    :ivar __notification_callable: callable with ``title`` and ``body`` as
-        arguments to call when a timer ends.
+        :param name: timer name.
+        :param notification_callable: callable to send notifications with.
+        :param phase: current phase.
+        :param stage: current Pomodoro stage, or the next one during breaks.
+        :param deadline: ending time of the current phase.
+
+        """
+        self.name: str = name
+        self.notification_callable: NotificationCallable = notification_callable
+        self.phase: Phase = phase
+        self.stage: int = stage
+        self.deadline: float = deadline
+
+
+class TimerService(object):
+    """Pomodoro timers sharing one event loop.
+
+    Any number of independent named timers are driven by a single task. The
+    end of the current phase of every timer is kept in one shared heap, and
+    the task sleeps until the earliest one. Starting or stopping a timer
+    cancels that sleep, so the next deadline is always honoured.
+
+    Every notification is sent in its own task, so a slow or failing one does
+    not delay the other timers, and its errors are logged. Coroutine
+    functions are awaited in the event loop, while synchronous callables run
+    in the default executor. Timers must only be started and stopped from
+    the event loop, e.g. from the notification coroutine functions.
+
+    :ivar __time_callable: :func:`time.time`-like callable to compute the
+        deadlines and notify current time.
+    :ivar __sleep_callable: :func:`asyncio.sleep`-like coroutine function.
     :ivar __logger: optional :class:`logging.Logger` instance to log info.
-    :cvar DEFAULT_PRIORITY: default scheduler priotiry.
+    :ivar __timers: running timers indexed by their name.
+    :ivar __heap: deadline, insertion order and timer of each phase end,
+        including the ones of stopped timers not popped yet.
+    :ivar __stale: number of heap entries of stopped timers.
+    :ivar __sleeper: sleep of the driving task, if it is sleeping.
+    :ivar __notifications: tasks sending notifications not finished yet.
+    :ivar __closed: whether the driving task has to finish or not.
     :cvar DELTA_START_TIME: timer wait until first pomodoro starts after
         starting the timer.
     :cvar DELTA_POMODORO_TIME: each pomodoro time span.
     :cvar DELTA_SHORT_BREAK_TIME: short breaks time span.
     :cvar DELTA_LONG_BREAK_TIME: long breaks time span.
+    :cvar DELTA_MAX_DELAY_TIME: maximum delay of a phase end after which the
+        next phases are scheduled from the current time instead, e.g. after
+        the computer was suspended.
 
     """
 
-    DEFAULT_PRIORITY: int = 1
     DELTA_START_TIME: int = 1 * 60
     DELTA_POMODORO_TIME: int = 25 * 60
     DELTA_SHORT_BREAK_TIME: int = 5 * 60
     DELTA_LONG_BREAK_TIME: int = 15 * 60
+    DELTA_MAX_DELAY_TIME: int = 1
 
     def __init__(
         self,
-        notification_callable: Optional[Callable[[str, str], None]] = None,
         time_callable: Callable[[], float] = time.time,
-        sleep_callable: Callable = time.sleep,
+        sleep_callable: Callable[[float], Awaitable] = asyncio.sleep,
         logger: Optional[logging.Logger] = None,
     ):
-        """Pomodoro timer constructor.
+        """Timer service constructor.
 
-        :param notification_callable: callable to send notifications with.
         :param time_callable: time-like function callable.
-        :param sleep_callable: sleep-like function callable.
+        :param sleep_callable: asynchronous sleep-like function callable.
         :param logger: information logger.
 
         """
         self.__time_callable: Callable[[], float] = time_callable
-        self.__scheduler: sched.scheduler = sched.scheduler(time_callable, sleep_callable)
-        self.__notification_callable: Callable[[str, str], None] = notification_callable or (
-            lambda title, body: print(title, body, sep="\n")
-        )
+        self.__sleep_callable: Callable[[float], Awaitable] = sleep_callable
         self.__logger: Optional[logging.Logger] = logger
-        self.__stop_scheduler: bool = False
+        self.__timers: Dict[str, Timer] = {}
+        self.__heap: List[Tuple[float, int, Timer]] = []
+        self.__sequence: Iterator[int] = itertools.count()
+        self.__stale: int = 0
+        self.__sleeper: Optional[asyncio.Future] = None
+        self.__notifications: Set[asyncio.Task] = set()
+        self.__closed: bool = False
+
+    def __contains__(self, name: str) -> bool:
+        """Check whether the timer is running.
+
+        :param name: timer name.
+        :returns: True if the timer is running.
+
+        """
+        return name in self.__timers
+
+    def __len__(self) -> int:
+        """Obtain the number of running timers.
+
+        :returns: the number of running timers.
+
+        """
+        return len(self.__timers)
 
     def __log(self, message: str) -> None:
         """Log message if logger exists.
@@ -159,27 +241,61 @@ class PomodoroTimer(object):
         if self.__logger:
             self.__logger.debug(message)
 
-    def __notify(self, title: str, body: str = "") -> None:
-        """Log and send the notification.
+    async def __send(self, timer: Timer, title: str, body: str) -> None:
+        """Send the notification of the timer, logging any error.
 
+        :param timer: timer sending the notification.
         :param title: title of the notification.
         :param body: body of the notification.
 
         """
-        self.__log(f"Sending notification. Title='{title}', Body='{body}'")
-        self.__notification_callable(title, body)
-
-    def __clean_jobs(self) -> None:
-        """Clean remaining jobs."""
-        while not self.__scheduler.empty():
-            try:
-                job: sched.Event = self.__scheduler.queue[0]
-                self.__log(f"Cancelling job: {job}")
-                self.__scheduler.cancel(job)
-            except ValueError:
-                pass
-        else:
-            self.__log("All jobs are finished.")
+        try:
+            if asyncio.iscoroutinefunction(timer.notification_callable):
+                await timer.notification_callable(title, body)
+            else:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, timer.notification_callable, title, body
+                )
+        except Exception:
+            if self.__logger:
+                self.__logger.exception(f"Error sending notification of {timer.name}.")
+            else:
+                print(f"Error sending notification of {timer.name}.", file=sys.stderr)
+
+    def __notify(self, timer: Timer, title: str, body: str = "") -> None:
+        """Log and send the notification of the timer in a new task.
+
+        Out of the event loop, e.g. when the timer is stopped after it was
+        interrupted, the notification is sent before returning.
+
+        :param timer: timer sending the notification.
+        :param title: title of the notification.
+        :param body: body of the notification.
+
+        """
+        self.__log(f"Sending notification of {timer.name}. Title='{title}', Body='{body}'")
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(self.__send(timer, title, body))
+            return
+
+        task: asyncio.Task = asyncio.ensure_future(self.__send(timer, title, body))
+        self.__notifications.add(task)
+        task.add_done_callback(self.__notifications.discard)
+
+    def __wake(self) -> None:
+        """Cancel the sleep of the driving task, so it looks at the heap again."""
+        if self.__sleeper is not None:
+            self.__sleeper.cancel()
+
+    def __push(self, timer: Timer) -> None:
+        """Add the end of the current phase of the timer to the heap.
+
+        :param timer: timer to schedule.
+
+        """
+        heapq.heappush(self.__heap, (timer.deadline, next(self.__sequence), timer))
 
     def __pomodoro_end_notification(
         self, current_stage: int, current_break_end_time: float
@@ -213,84 +329,217 @@ class PomodoroTimer(object):
 
         return {"title": f"POM[{next_stage}]::START. Next break at {next_break_string}."}
 
-    def __schedule_pomodoro(self, current_stage: int) -> None:
-        """Schedule one Pomodoro and it's break time.
+    def __advance(self, timer: Timer, current_time: float) -> Dict[str, str]:
+        """Move the timer to the phase following the current one.
 
-        If we are in the forth stage of Pomodoro, we will take a longer break.
+        If the forth Pomodoro ends, we will take a longer break. The next
+        phase starts when the current one should have ended, so the timer
+        does not drift, unless it ended too long ago.
 
-        :param current_stage: current Pomodoro stage
-        """
-        current_time: float = self.__time_callable()
-        current_pomodoro_end_time: float = current_time + self.DELTA_POMODORO_TIME
-        next_stage: int
-        current_break_end_time: float
-        next_pomodoro_end_time: float
+        :param timer: timer whose current phase ended.
+        :param current_time: current time in seconds since epoch.
+        :returns: the notification to send for the ended phase.
 
+        """
+        if current_time - timer.deadline > self.DELTA_MAX_DELAY_TIME:
+            self.__log(f"Timer {timer.name} is late, scheduling it from the current time.")
+            timer.deadline = current_time
+
+        if timer.phase == Phase.BREAK:
+            timer.phase = Phase.POMODORO
+            timer.deadline += self.DELTA_POMODORO_TIME
+            self.__log(f"Starting next Pomodoro of {timer.name}...")
+            return self.__break_end_notification(timer.stage, timer.deadline)
+
+        current_stage: int = timer.stage
+        timer.phase = Phase.BREAK
         if current_stage == 4:
-            next_stage = 1
-            current_break_end_time = current_pomodoro_end_time + self.DELTA_LONG_BREAK_TIME
+            timer.stage = 1
+            timer.deadline += self.DELTA_LONG_BREAK_TIME
         else:
-            next_stage = current_stage + 1
-            current_break_end_time = current_pomodoro_end_time + self.DELTA_SHORT_BREAK_TIME
+            timer.stage = current_stage + 1
+            timer.deadline += self.DELTA_SHORT_BREAK_TIME
 
-        next_pomodoro_end_time = current_break_end_time + self.DELTA_POMODORO_TIME
+        return self.__pomodoro_end_notification(current_stage, timer.deadline)
 
-        # Pomodoro end notification: break start
-        self.__scheduler.enterabs(
-            current_pomodoro_end_time,
-            self.DEFAULT_PRIORITY,
-            self.__notify,
-            kwargs=self.__pomodoro_end_notification(current_stage, current_break_end_time),
-        )
+    def start(self, name: str, notification_callable: NotificationCallable) -> None:
+        """Start a new timer.
 
-        # Break end notification: next Pomodoro start
-        self.__scheduler.enterabs(
-            current_break_end_time,
-            self.DEFAULT_PRIORITY,
-            self.__notify,
-            kwargs=self.__break_end_notification(next_stage, next_pomodoro_end_time),
+        :param name: timer name.
+        :param notification_callable: callable to send notifications with.
+        :raises ValueError: if there is a running timer with that name.
+
+        """
+        if name in self.__timers:
+            raise ValueError(f"The timer {name} is already running.")
+
+        current_time: float = self.__time_callable()
+        # Waiting for the first Pomodoro is handled like a break
+        timer: Timer = Timer(
+            name, notification_callable, Phase.BREAK, 1, current_time + self.DELTA_START_TIME
+        )
+        self.__timers[name] = timer
+        self.__push(timer)
+        self.__wake()
+
+        current_time_str: str = time.strftime("%H:%M", time.localtime(current_time))
+        self.__log(f"Starting Pomodoro Timer {name}.")
+        self.__notify(
+            timer,
+            "Pomodoro Timer",
+            f"Current time {current_time_str}: Sarting Pomodoro in one minute...",
         )
 
-        self.__scheduler.run()
+    def stop(self, name: str) -> None:
+        """Stop a running timer.
+
+        Its pending heap entry is left behind and skipped later, and the heap
+        is rebuilt once most of it is made of such entries.
 
-        if not self.__stop_scheduler:
-            self.__log("Starting next Pomodoro...")
-            self.__schedule_pomodoro(next_stage)
+        :param name: timer name.
+        :raises KeyError: if there is no running timer with that name.
+
+        """
+        timer: Timer = self.__timers.pop(name)
+        self.__stale += 1
+        if self.__stale > len(self.__heap) // 2:
+            self.__heap = [
+                entry for entry in self.__heap if self.__timers.get(entry[2].name) is entry[2]
+            ]
+            heapq.heapify(self.__heap)
+            self.__stale = 0
+        self.__wake()
+
+        self.__log(f"Stopping Pomodoro timer {name}...")
+        self.__notify(timer, "Stopping Pomodoro timer...")
+
+    def close(self) -> None:
+        """Make :meth:`run` return, leaving the timers as they are."""
+        self.__closed = True
+        self.__wake()
+
+    async def __sleep(self, delay: Optional[float]) -> None:
+        """Sleep until the delay expires or the sleep is cancelled.
+
+        :param delay: seconds to sleep, or None to sleep until cancelled.
+
+        """
+        if delay is None:
+            self.__sleeper = asyncio.get_running_loop().create_future()
+        else:
+            self.__sleeper = asyncio.ensure_future(self.__sleep_callable(delay))
+
+        try:
+            # Unlike awaiting the sleep, waiting for it does not raise when
+            # it is cancelled
+            await asyncio.wait((self.__sleeper,))
+        finally:
+            self.__sleeper.cancel()
+            self.__sleeper = None
+
+    async def run(self) -> None:
+        """Drive the timers until the service is closed.
+
+        Before returning, it waits for the notifications being sent.
+
+        """
+        self.__closed = False
+        heap: List[Tuple[float, int, Timer]]
+
+        while not self.__closed:
+            heap = self.__heap
+            if not heap:
+                await self.__sleep(None)
+                continue
+
+            deadline, _, timer = heap[0]
+            if self.__timers.get(timer.name) is not timer:
+                heapq.heappop(heap)
+                self.__stale -= 1
+                continue
+
+            current_time: float = self.__time_callable()
+            if deadline > current_time:
+                await self.__sleep(deadline - current_time)
+                continue
+
+            notification: Dict[str, str] = self.__advance(timer, current_time)
+            heapq.heapreplace(heap, (timer.deadline, next(self.__sequence), timer))
+            self.__notify(timer, **notification)
+
+        while self.__notifications:
+            await asyncio.wait(set(self.__notifications))
+
+
+class PomodoroTimer(object):
+    """Pomodoro timer.
+
+    This class allow to run a Pomodoro Timer notifying when time slots expire.
+    It runs a single timer of a :class:`TimerService`, blocking the calling
+    thread until the timer is stopped. As there are no other timers to delay,
+    the notifications are sent from the event loop, so the notification
+    callable may stop the timer.
+
+    :ivar __service: timer service driving the timer.
+    :ivar __notification_callable: coroutine function with ``title`` and
+        ``body`` as arguments to call when a timer ends.
+    :cvar NAME: name of the timer in the service.
+
+    """
+
+    NAME: str = "pomodoro"
+
+    def __init__(
+        self,
+        notification_callable: Optional[Callable[[str, str], None]] = None,
+        time_callable: Callable[[], float] = time.time,
+        sleep_callable: Optional[Callable[[float], None]] = None,
+        logger: Optional[logging.Logger] = None,
+    ):
+        """Pomodoro timer constructor.
+
+        :param notification_callable: callable to send notifications with.
+        :param time_callable: time-like function callable.
+        :param sleep_callable: sleep-like function callable, by default the
+            timer sleeps asynchronously.
+        :param logger: information logger.
+
+        """
+        async_sleep_callable: Callable[[float], Awaitable]
+        if sleep_callable is None:
+            async_sleep_callable = asyncio.sleep
+        else:
+
+            async def async_sleep_callable(delay: float) -> None:
+                sleep_callable(delay)
+
+        self.__service: TimerService = TimerService(time_callable, async_sleep_callable, logger)
+
+        async def async_notification_callable(title: str, body: str) -> None:
+            if notification_callable is None:
+                print(title, body, sep="\n")
+            else:
+                notification_callable(title, body)
+
+        self.__notification_callable: Callable[[str, str], Awaitable] = async_notification_callable
+
+    async def __run(self) -> None:
+        """Start the timer and drive it until it is stopped."""
+        self.__service.start(self.NAME, self.__notification_callable)
+        await self.__service.run()
 
     def run(self):
         """Start Pomodoro timer."""
         try:
-            self.__stop_scheduler = False
-            current_time: float = self.__time_callable()
-            current_time_str: str = time.strftime("%H:%M", time.localtime(current_time))
-            self.__notify(
-                "Pomodoro Timer",
-                f"Current time {current_time_str}: Sarting Pomodoro in one minute...",
-            )
-            self.__log("Starting Pomodoro Timer.")
-            next_stage: int = 1
-            current_break_end_time: float = current_time + self.DELTA_START_TIME
-            next_pomodoro_end_time: float = current_break_end_time + self.DELTA_POMODORO_TIME
-            self.__scheduler.enterabs(
-                current_break_end_time,
-                self.DEFAULT_PRIORITY,
-                self.__notify,
-                kwargs=self.__break_end_notification(next_stage, next_pomodoro_end_time),
-            )
-
-            self.__scheduler.run()
-
-            if not self.__stop_scheduler:
-                self.__schedule_pomodoro(next_stage)
+            asyncio.run(self.__run())
         except KeyboardInterrupt:
             self.stop()
 
     def stop(self):
-        """Stop scheduler."""
-        self.__log("Stopping the scheduler...")
-        self.__stop_scheduler = True
-        self.__notify("Stopping Pomodoro timer...")
-        self.__clean_jobs()
+        """Stop the timer."""
+        if self.NAME in self.__service:
+            self.__service.stop(self.NAME)
+        self.__service.close()
 
 
 def get_update_function(notifier: Notifier, logger: logging.Logger) -> Callable: